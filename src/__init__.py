@@ -8,6 +8,7 @@ from .lua_decoder import LuaDecoder
 from .lua_module_resolver import LuaModuleResolver
 from .llm_client import OpenRouterClient
 from .dependency_graph import DependencyGraph
+from .llm_cache import LLMCache
 
 __version__ = "1.0.0"
 __author__ = "Lua Decoder Team"
@@ -16,5 +17,6 @@ __all__ = [
     "LuaDecoder",
     "LuaModuleResolver", 
     "OpenRouterClient",
-    "DependencyGraph"
+    "DependencyGraph",
+    "LLMCache"
 ]
@@ -5,28 +5,100 @@
 负责管理Lua文件之间的依赖关系，实现拓扑排序
 """
 
-import json
 import datetime
+import orjson
 from typing import Dict, List, Set, Tuple, Optional
 from pathlib import Path
-from collections import defaultdict, deque
+from array import array
+from collections import defaultdict
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 import logging
 
 
+@lru_cache(maxsize=None)
+def _resolve_str(path: str) -> str:
+    """
+    将路径规范化为绝对路径字符串（带缓存）
+    
+    Path.resolve() 每次都会通过 realpath 访问文件系统，而同一次运行中
+    文件路径是稳定的，因此按字符串缓存结果。如果运行期间文件被移动或
+    符号链接发生变化，应调用 _resolve_str.cache_clear() 并重建 DependencyGraph。
+    
+    Args:
+        path: 文件路径
+        
+    Returns:
+        规范化后的绝对路径字符串
+    """
+    return str(Path(path).resolve())
+
+
 class DependencyGraph:
     """Lua文件依赖图管理器"""
     
     def __init__(self):
         """初始化依赖图"""
-        self.graph = defaultdict(set)  # 邻接表
-        self.reverse_graph = defaultdict(set)  # 反向邻接表
+        # 节点以整数ID存储：路径 <-> ID 的双向映射
+        self._ids: Dict[str, int] = {}  # 文件路径到节点ID的映射
+        self._paths: List[str] = []  # 节点ID到文件路径的映射
+        # 按节点ID索引的邻接数组，每个节点一个紧凑的 array('i')
+        self._adj: List[array] = []  # 邻接表：依赖 -> 使用者
+        self._radj: List[array] = []  # 反向邻接表：使用者 -> 依赖
+        # 已有的 (依赖, 使用者) 边，插入时O(1)去重，避免线性扫描邻接数组
+        self._edges: Set[Tuple[int, int]] = set()
         self.file_to_module = {}  # 文件路径到模块名的映射
         self.module_to_file = {}  # 模块名到文件路径的映射
         self.file_contents = {}  # 文件内容缓存
-        # 记录暂未解析到文件的模块依赖：module_name -> set(consumer_file_path)
+        # 记录暂未解析到文件的模块依赖：module_name -> set(consumer_node_id)
         self.pending_module_dependents = defaultdict(set)
+        # 整图拓扑分层结果的缓存，图发生变化时置为None
+        self._topo_cache: Optional[List[List[str]]] = None
         self.logger = logging.getLogger(__name__)
     
+    def __len__(self) -> int:
+        """图中的节点数"""
+        return len(self._paths)
+    
+    @property
+    def graph(self) -> Dict[str, Set[str]]:
+        """邻接表视图（依赖 -> 使用者），每次访问都会重新生成"""
+        paths = self._paths
+        return {paths[i]: {paths[j] for j in succ} for i, succ in enumerate(self._adj)}
+    
+    @property
+    def reverse_graph(self) -> Dict[str, Set[str]]:
+        """反向邻接表视图（使用者 -> 依赖），每次访问都会重新生成"""
+        paths = self._paths
+        return {paths[i]: {paths[j] for j in pred} for i, pred in enumerate(self._radj)}
+    
+    def _node_id(self, file_path: str) -> int:
+        """
+        获取节点ID，首次出现的路径分配新ID
+        
+        Args:
+            file_path: 规范化后的文件路径
+            
+        Returns:
+            节点ID
+        """
+        node = self._ids.get(file_path)
+        if node is None:
+            node = len(self._paths)
+            self._ids[file_path] = node
+            self._paths.append(file_path)
+            self._adj.append(array('i'))
+            self._radj.append(array('i'))
+        return node
+    
+    def _add_edge(self, dep: int, consumer: int):
+        """添加 依赖 -> 使用者 的有向边，已存在时忽略"""
+        edge = (dep, consumer)
+        if edge not in self._edges:
+            self._edges.add(edge)
+            self._adj[dep].append(consumer)
+            self._radj[consumer].append(dep)
+    
     def add_file(self, file_path: Path, module_name: str, content: str = None):
         """
         添加文件到依赖图
@@ -36,27 +108,73 @@ class DependencyGraph:
             module_name: 模块名
             content: 文件内容
         """
-        file_path = Path(file_path).resolve()
-        self.file_to_module[str(file_path)] = module_name
-        self.module_to_file[module_name] = str(file_path)
+        file_path = _resolve_str(str(file_path))
+        self._topo_cache = None
+        self.file_to_module[file_path] = module_name
+        self.module_to_file[module_name] = file_path
         
         if content:
-            self.file_contents[str(file_path)] = content
+            self.file_contents[file_path] = content
         
         # 初始化图节点
-        if str(file_path) not in self.graph:
-            self.graph[str(file_path)] = set()
-        if str(file_path) not in self.reverse_graph:
-            self.reverse_graph[str(file_path)] = set()
+        node = self._node_id(file_path)
 
         # 将挂起依赖回填到图：已知该模块对应文件后，建立 依赖 -> 使用者 的边
-        pending = self.pending_module_dependents.pop(module_name, set())
-        for consumer in pending:
-            # graph: dependency -> consumer
-            self.graph[str(file_path)].add(consumer)
-            if consumer not in self.reverse_graph:
-                self.reverse_graph[consumer] = set()
-            self.reverse_graph[consumer].add(str(file_path))
+        for consumer in self.pending_module_dependents.pop(module_name, ()):
+            self._add_edge(node, consumer)
+    
+    def bulk_add_files(self, paths_and_modules: List[Tuple[Path, str]], workers: int = 4):
+        """
+        批量添加文件到依赖图
+        
+        文件内容由线程池并行读取，读取完成后再逐个调用 add_file，
+        图的修改始终在调用线程中进行，无需加锁
+        
+        Args:
+            paths_and_modules: (文件路径, 模块名) 列表
+            workers: 读取文件的线程数
+        """
+        paths = [file_path for file_path, _ in paths_and_modules]
+        results = self.read_files(paths, workers)
+        
+        for (file_path, module_name), (content, error) in zip(paths_and_modules, results):
+            if error is not None:
+                self.logger.warning(f"读取文件 {file_path} 失败: {error}")
+            self.add_file(file_path, module_name, content)
+    
+    def read_file(self, file_path: Path) -> Tuple[Optional[str], Optional[str]]:
+        """
+        读取文件内容，已缓存的内容不再读盘
+        
+        Args:
+            file_path: 文件路径
+            
+        Returns:
+            (内容, 错误信息)，读取失败时内容为None
+        """
+        content = self.get_content(file_path)
+        if content is not None:
+            return content, None
+        
+        try:
+            with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
+                return f.read(), None
+        except Exception as e:
+            return None, str(e)
+    
+    def read_files(self, file_paths: List[Path], workers: int = 4) -> List[Tuple[Optional[str], Optional[str]]]:
+        """
+        用线程池并行读取一批文件，只读不修改图，可在任意线程中调用
+        
+        Args:
+            file_paths: 文件路径列表
+            workers: 读取文件的线程数
+            
+        Returns:
+            与输入顺序一致的 (内容, 错误信息) 列表
+        """
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(self.read_file, file_paths))
     
     def add_dependency(self, from_file: Path, to_module: str):
         """
@@ -66,25 +184,38 @@ class DependencyGraph:
             from_file: 依赖源文件
             to_module: 被依赖的模块名
         """
-        from_file = Path(from_file).resolve()
-        from_file_str = str(from_file)
-        
-        if from_file_str not in self.graph:
-            self.graph[from_file_str] = set()
+        consumer = self._node_id(_resolve_str(str(from_file)))
+        self._topo_cache = None
         
         # 如果模块已解析为文件：建立 依赖 -> 使用者 的有向边
-        if to_module in self.module_to_file:
-            to_file = self.module_to_file[to_module]
-            if to_file not in self.graph:
-                self.graph[to_file] = set()
-            if from_file_str not in self.reverse_graph:
-                self.reverse_graph[from_file_str] = set()
-            # dependency -> consumer
-            self.graph[to_file].add(from_file_str)
-            self.reverse_graph[from_file_str].add(to_file)
+        to_file = self.module_to_file.get(to_module)
+        if to_file is not None:
+            # add_file 已为该文件分配节点ID
+            self._add_edge(self._ids[to_file], consumer)
         else:
             # 目标模块尚未解析成文件，先挂起，待 add_file 时回填
-            self.pending_module_dependents[to_module].add(from_file_str)
+            self.pending_module_dependents[to_module].add(consumer)
+    
+    def get_all_files(self) -> List[str]:
+        """
+        获取图中的所有文件
+        
+        Returns:
+            按加入顺序排列的文件路径列表
+        """
+        return self._paths[:]
+    
+    def get_content(self, file_path: Path) -> Optional[str]:
+        """
+        获取缓存的文件内容
+        
+        Args:
+            file_path: 文件路径
+            
+        Returns:
+            文件内容，未缓存时返回None
+        """
+        return self.file_contents.get(_resolve_str(str(file_path)))
     
     def get_dependencies(self, file_path: Path) -> Set[str]:
         """
@@ -96,9 +227,11 @@ class DependencyGraph:
         Returns:
             依赖的文件路径集合
         """
-        file_path = Path(file_path).resolve()
         # 返回当前文件所依赖的文件集合（使用反向图）
-        return self.reverse_graph.get(str(file_path), set())
+        node = self._ids.get(_resolve_str(str(file_path)))
+        if node is None:
+            return set()
+        return {self._paths[dep] for dep in self._radj[node]}
     
     def get_dependents(self, file_path: Path) -> Set[str]:
         """
@@ -110,9 +243,11 @@ class DependencyGraph:
         Returns:
             依赖此文件的文件路径集合
         """
-        file_path = Path(file_path).resolve()
         # 返回依赖此文件的其他文件（使用正向图）
-        return self.graph.get(str(file_path), set())
+        node = self._ids.get(_resolve_str(str(file_path)))
+        if node is None:
+            return set()
+        return {self._paths[consumer] for consumer in self._adj[node]}
     
     def get_all_dependencies(self, file_path: Path) -> Set[str]:
         """
@@ -124,59 +259,144 @@ class DependencyGraph:
         Returns:
             所有依赖的文件路径集合
         """
-        file_path = Path(file_path).resolve()
-        visited = set()
+        start = self._ids.get(_resolve_str(str(file_path)))
+        if start is None:
+            return set()
+        return {self._paths[node] for node in self._collect_dependencies(start)}
+    
+    def _collect_dependencies(self, start: int) -> Set[int]:
+        """收集节点的所有（直接及间接）依赖的节点ID"""
+        visited = {start}
         dependencies = set()
         
-        def dfs(node):
-            if node in visited:
-                return
-            visited.add(node)
+        # 显式栈代替递归，避免深层依赖链触发RecursionError
+        stack = [start]
+        while stack:
+            node = stack.pop()
             # 通过反向图获取依赖链（consumer -> dependency）
-            for dep in self.reverse_graph.get(node, set()):
+            for dep in self._radj[node]:
                 dependencies.add(dep)
-                dfs(dep)
+                if dep not in visited:
+                    visited.add(dep)
+                    stack.append(dep)
         
-        dfs(str(file_path))
         return dependencies
     
-    def topological_sort(self) -> List[str]:
+    def _as_csr(self, nodes: Optional[Set[int]] = None) -> Tuple[List[int], array, array]:
+        """
+        将邻接表转换为CSR（压缩稀疏行）形式
+        
+        节点 i 的后继为 indices[indptr[i]:indptr[i + 1]]，遍历时只做整数运算
+        
+        Args:
+            nodes: 只保留这些节点ID及它们之间的边，为None时使用整个图
+            
+        Returns:
+            (下标到节点ID的列表, indptr, indices)
+        """
+        indptr = array('i', [0])
+        indices = array('i')
+        
+        if nodes is None:
+            # 整图的下标即节点ID，邻接数组直接拼接
+            for succ in self._adj:
+                indices.extend(succ)
+                indptr.append(len(indices))
+            return list(range(len(self._adj))), indptr, indices
+        
+        node_list = sorted(nodes)
+        local = {node: i for i, node in enumerate(node_list)}
+        for node in node_list:
+            # 子图之外的节点，忽略这条边
+            indices.extend(local[dep] for dep in self._adj[node] if dep in local)
+            indptr.append(len(indices))
+        
+        return node_list, indptr, indices
+    
+    def topological_sort(self, nodes: Optional[Set[str]] = None) -> List[str]:
         """
         执行拓扑排序
         
+        Args:
+            nodes: 只对这些节点构成的子图排序，为None时对整个图排序
+        
         Returns:
             排序后的文件路径列表
         """
-        # 计算入度
-        in_degree = defaultdict(int)
-        for node in self.graph:
-            in_degree[node] = 0
+        # FIFO的Kahn算法恰好按层输出节点，因此直接展开分层结果
+        return [node for level in self.topological_levels(nodes) for node in level]
+    
+    def topological_levels(self, nodes: Optional[Set[str]] = None) -> List[List[str]]:
+        """
+        按层执行拓扑排序
+        
+        每一层中的文件只依赖于之前各层的文件，同层文件之间互不依赖，可以并行处理
+        
+        Args:
+            nodes: 只对这些节点构成的子图排序，为None时对整个图排序
         
-        for node, deps in self.graph.items():
-            for dep in deps:
+        Returns:
+            分层后的文件路径列表
+        """
+        # 整图的排序结果在图未变化时直接复用
+        if nodes is None and self._topo_cache is not None:
+            return [level[:] for level in self._topo_cache]
+        
+        node_ids = None
+        if nodes is not None:
+            node_ids = {self._ids.get(node) for node in nodes}
+            node_ids.discard(None)
+        levels = [[self._paths[node] for node in level]
+                  for level in self._topological_levels_ids(node_ids)]
+        
+        if nodes is None:
+            self._topo_cache = levels
+            return [level[:] for level in levels]
+        return levels
+    
+    def _topological_levels_ids(self, nodes: Optional[Set[int]] = None) -> List[List[int]]:
+        """在节点ID上执行分层的Kahn算法"""
+        # 计算入度：按节点下标定长的整数数组
+        if nodes is None:
+            # 整图的下标即节点ID，直接使用邻接数组；
+            # 节点的入度就是它在反向邻接表中的依赖数
+            successors = self._adj
+            in_degree = array('i', map(len, self._radj))
+        else:
+            node_list, indptr, indices = self._as_csr(nodes)
+            successors = [indices[indptr[i]:indptr[i + 1]] for i in range(len(node_list))]
+            in_degree = array('i', [0]) * len(node_list)
+            for dep in indices:
                 in_degree[dep] += 1
         
-        # 拓扑排序
-        queue = deque([node for node in self.graph if in_degree[node] == 0])
-        result = []
+        # Kahn算法，每轮取出所有入度为0的节点作为一层
+        level = [i for i, degree in enumerate(in_degree) if degree == 0]
+        levels = []
+        visited_count = 0
         
-        while queue:
-            node = queue.popleft()
-            result.append(node)
+        while level:
+            # 整图的下标即节点ID，无需再映射
+            levels.append(level if nodes is None else [node_list[i] for i in level])
+            visited_count += len(level)
             
-            for dep in self.graph.get(node, set()):
-                in_degree[dep] -= 1
-                if in_degree[dep] == 0:
-                    queue.append(dep)
+            next_level = []
+            for node in level:
+                for dep in successors[node]:
+                    degree = in_degree[dep] - 1
+                    in_degree[dep] = degree
+                    if degree == 0:
+                        next_level.append(dep)
+            level = next_level
         
         # 检查是否有环
-        if len(result) != len(self.graph):
+        if visited_count != len(in_degree):
             self.logger.warning("检测到循环依赖！")
             # 找出剩余的节点（可能形成环）
-            remaining = set(self.graph.keys()) - set(result)
+            remaining = {self._paths[i if nodes is None else node_list[i]]
+                         for i, degree in enumerate(in_degree) if degree > 0}
             self.logger.warning(f"可能形成环的节点: {remaining}")
         
-        return result
+        return levels
     
     def detect_cycles(self) -> List[List[str]]:
         """
@@ -186,32 +406,36 @@ class DependencyGraph:
             循环依赖的路径列表
         """
         cycles = []
-        visited = set()
-        rec_stack = set()
-        
-        def dfs(node, path):
-            if node in rec_stack:
-                # 找到环
-                cycle_start = path.index(node)
-                cycles.append(path[cycle_start:] + [node])
-                return
-            
-            if node in visited:
-                return
-            
-            visited.add(node)
-            rec_stack.add(node)
-            path.append(node)
+        visited = bytearray(len(self._paths))
+        paths = self._paths
+        
+        # 显式栈代替递归：path 为当前DFS路径，stack 保存路径上各节点的后继迭代器
+        for root in range(len(paths)):
+            if visited[root]:
+                continue
             
-            for dep in self.graph.get(node, set()):
-                dfs(dep, path.copy())
+            visited[root] = 1
+            path = [root]
+            on_path = {root}
+            stack = [iter(self._adj[root])]
             
-            rec_stack.remove(node)
-            path.pop()
-        
-        for node in self.graph:
-            if node not in visited:
-                dfs(node, [])
+            while stack:
+                for dep in stack[-1]:
+                    if dep in on_path:
+                        # 找到环
+                        cycle_start = path.index(dep)
+                        cycles.append([paths[node] for node in path[cycle_start:]] + [paths[dep]])
+                    elif not visited[dep]:
+                        # 深入下一层
+                        visited[dep] = 1
+                        path.append(dep)
+                        on_path.add(dep)
+                        stack.append(iter(self._adj[dep]))
+                        break
+                else:
+                    # 后继已遍历完，回溯
+                    stack.pop()
+                    on_path.discard(path.pop())
         
         return cycles
     
@@ -225,31 +449,18 @@ class DependencyGraph:
         Returns:
             恢复顺序的文件路径列表
         """
-        start_file = Path(start_file).resolve()
-        start_file_str = str(start_file)
+        start_file_str = _resolve_str(str(start_file))
+        start = self._ids.get(start_file_str)
         
-        if start_file_str not in self.graph:
+        if start is None:
             return [start_file_str]
         
-        # 获取所有依赖
-        all_deps = self.get_all_dependencies(start_file_str)
+        # 只对起始文件及其所有依赖构成的子图排序
+        subgraph_nodes = self._collect_dependencies(start)
+        subgraph_nodes.add(start)
         
-        # 构建子图
-        subgraph = {}
-        for dep in all_deps:
-            subgraph[dep] = self.graph.get(dep, set())
-        subgraph[start_file_str] = self.graph.get(start_file_str, set())
-        
-        # 对子图进行拓扑排序
-        temp_graph = self.graph.copy()
-        self.graph = subgraph
-        
-        try:
-            result = self.topological_sort()
-        finally:
-            self.graph = temp_graph
-        
-        return result
+        return [self._paths[node] for level in self._topological_levels_ids(subgraph_nodes)
+                for node in level]
     
     def print_graph(self):
         """打印依赖图结构"""
@@ -275,12 +486,13 @@ class DependencyGraph:
             f.write("  rankdir=LR;\n")
             f.write("  node [shape=box];\n\n")
             
-            for file_path, deps in self.graph.items():
+            paths = self._paths
+            for file_path, succ in zip(paths, self._adj):
                 module_name = self.file_to_module.get(file_path, "未知")
                 f.write(f'  "{file_path}" [label="{module_name}"];\n')
                 
-                for dep in deps:
-                    f.write(f'  "{file_path}" -> "{dep}";\n')
+                for dep in succ:
+                    f.write(f'  "{file_path}" -> "{paths[dep]}";\n')
             
             f.write("}\n")
         
@@ -290,54 +502,72 @@ class DependencyGraph:
         """
         导出为JSON格式
         
+        逐条写入记录，不在内存中构建完整的JSON对象
+        
         Args:
             output_file: 输出文件路径
         """
-        dependency_data = {
-            "metadata": {
-                "total_files": len(self.graph),
-                "total_dependencies": sum(len(deps) for deps in self.graph.values()),
-                "generated_at": str(datetime.datetime.now())
-            },
-            "files": [],
-            "dependencies": [],
-            "topological_order": self.topological_sort()
+        metadata = {
+            "total_files": len(self._paths),
+            "total_dependencies": sum(len(succ) for succ in self._adj),
+            "generated_at": str(datetime.datetime.now())
         }
         
-        # 添加文件信息
-        for file_path, deps in self.graph.items():
-            module_name = self.file_to_module.get(file_path, "未知模块")
-            file_info = {
+        # orjson直接输出UTF-8字节，以二进制方式写入
+        with open(output_file, 'wb') as f:
+            f.write(b"{\n")
+            f.write(b'  "metadata": ' + orjson.dumps(metadata) + b",\n")
+            # 添加文件信息
+            self._write_json_array(f, "files", self._iter_file_records())
+            f.write(b",\n")
+            # 添加依赖关系
+            self._write_json_array(f, "dependencies", self._iter_dependency_records())
+            f.write(b",\n")
+            self._write_json_array(f, "topological_order", self.topological_sort())
+            f.write(b"\n}\n")
+        
+        self.logger.info(f"依赖关系JSON已导出到: {output_file}")
+    
+    def _iter_file_records(self):
+        """逐个生成文件信息记录"""
+        for file_path, succ, pred in zip(self._paths, self._adj, self._radj):
+            yield {
                 "file_path": file_path,
-                "module_name": module_name,
-                "dependencies_count": len(deps),
-                "dependents_count": len(self.reverse_graph.get(file_path, set()))
+                "module_name": self.file_to_module.get(file_path, "未知模块"),
+                "dependencies_count": len(succ),
+                "dependents_count": len(pred)
             }
-            dependency_data["files"].append(file_info)
-        
-        # 添加依赖关系
-        for file_path, deps in self.graph.items():
-            for dep in deps:
-                dependency_info = {
+    
+    def _iter_dependency_records(self):
+        """逐条生成依赖关系记录"""
+        paths = self._paths
+        for file_path, succ in zip(paths, self._adj):
+            for dep in succ:
+                yield {
                     "from": file_path,
-                    "to": dep,
+                    "to": paths[dep],
                     "from_module": self.file_to_module.get(file_path, "未知模块"),
-                    "to_module": self.file_to_module.get(dep, "未知模块")
+                    "to_module": self.file_to_module.get(paths[dep], "未知模块")
                 }
-                dependency_data["dependencies"].append(dependency_info)
-        
-        # 写入JSON文件
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(dependency_data, f, ensure_ascii=False, indent=2)
-        
-        self.logger.info(f"依赖关系JSON已导出到: {output_file}")
+    
+    @staticmethod
+    def _write_json_array(f, key: str, records):
+        """将记录逐条写为JSON数组字段，每条记录占一行（f 为二进制文件）"""
+        f.write(b"  " + orjson.dumps(key) + b": [")
+        first = True
+        for record in records:
+            f.write(b"\n    " if first else b",\n    ")
+            f.write(orjson.dumps(record))
+            first = False
+        f.write(b"]" if first else b"\n  ]")
     
     def get_statistics(self) -> Dict[str, int]:
         """获取依赖图统计信息"""
-        total_files = len(self.graph)
-        total_deps = sum(len(deps) for deps in self.graph.values())
-        max_deps = max(len(deps) for deps in self.graph.values()) if self.graph else 0
-        min_deps = min(len(deps) for deps in self.graph.values()) if self.graph else 0
+        total_files = len(self._paths)
+        counts = [len(succ) for succ in self._adj]
+        total_deps = sum(counts)
+        max_deps = max(counts, default=0)
+        min_deps = min(counts, default=0)
         
         return {
             "total_files": total_files,
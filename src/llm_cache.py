@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+LLM响应缓存
+将API响应持久化到本地SQLite数据库，避免重复请求相同的提示词
+"""
+
+import time
+import zlib
+import orjson
+import sqlite3
+import hashlib
+import threading
+from pathlib import Path
+from typing import Dict, Optional, Any
+import logging
+
+
+class LLMCache:
+    """基于SQLite的LLM响应持久化缓存"""
+
+    DB_NAME = "responses.sqlite"
+
+    def __init__(self, cache_dir: str = ".llm_cache", ttl: Optional[float] = None):
+        """
+        初始化缓存
+
+        Args:
+            cache_dir: 缓存目录，数据库文件保存在该目录下
+            ttl: 缓存有效期（秒），为None或0时永不过期
+        """
+        self.cache_dir = Path(cache_dir)
+        self.ttl = ttl or None
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.db_path = self.cache_dir / self.DB_NAME
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, "
+            "response TEXT NOT NULL, "
+            "created REAL NOT NULL)"
+        )
+        if self.ttl is not None:
+            # 打开时顺带清理已过期的条目
+            self._conn.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.ttl,))
+        self._conn.commit()
+        self.logger = logging.getLogger(__name__)
+
+    @staticmethod
+    def make_key(model: str, prompt: str) -> str:
+        """
+        根据模型名和提示词生成缓存键
+
+        Args:
+            model: 模型名称
+            prompt: 提示词
+
+        Returns:
+            缓存键（十六进制摘要）
+        """
+        return hashlib.blake2b((model + prompt).encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        读取缓存的响应
+
+        Args:
+            key: 缓存键
+
+        Returns:
+            缓存的响应字典，未命中或已过期则返回None
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+
+        if row is None:
+            return None
+
+        response, created = row
+        if self.ttl is not None and time.time() - created > self.ttl:
+            return None
+
+        try:
+            # 新条目为压缩后的BLOB，旧版本写入的是JSON文本
+            if isinstance(response, bytes):
+                response = zlib.decompress(response)
+            return orjson.loads(response)
+        except (zlib.error, orjson.JSONDecodeError) as e:
+            self.logger.warning(f"缓存条目损坏，已忽略: {e}")
+            return None
+
+    def set(self, key: str, response: Dict[str, Any]):
+        """
+        写入响应到缓存，响应以zlib压缩后的JSON保存
+
+        Args:
+            key: 缓存键
+            response: API响应字典
+        """
+        data = zlib.compress(orjson.dumps(response))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, created) VALUES (?, ?, ?)",
+                (key, data, time.time())
+            )
+            self._conn.commit()
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            self._conn.close()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
@@ -5,18 +5,107 @@ OpenRouter LLM客户端
 负责与OpenRouter API通信，进行Lua代码分析和恢复
 """
 
-import json
+import re
 import time
-import requests
-from typing import Dict, List, Optional, Any
+import asyncio
+import httpx
+import orjson
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Callable, Dict, List, Optional, Any, Tuple
 from pathlib import Path
 import logging
 
+from llm_cache import LLMCache
+
+
+# 顶层函数定义的起始位置，超大文件在这些位置切分
+_FUNCTION_BOUNDARY_RE = re.compile(r'^(?=(?:local\s+)?function )', re.MULTILINE)
+
+# Markdown代码块，响应被max_tokens截断时可能缺少结尾的围栏；
+# 优先匹配标注了lua/json的代码块，没有时再取第一个任意代码块
+_TAGGED_CODE_BLOCK_RE = re.compile(r"```(?:lua|json)\b[ \t]*\n?(.*?)(?:```|\Z)", re.DOTALL)
+_CODE_BLOCK_RE = re.compile(r"```(?:lua|json)?[ \t]*\n?(.*?)(?:```|\Z)", re.DOTALL)
+
+# 提示词分为两部分：系统提示词只包含固定的说明，每次请求逐字节相同，
+# 可以被服务端作为前缀缓存；用户提示词模板只在调用时填充文件路径、内容等可变部分
+_ANALYSIS_SYSTEM = """你是一个Lua代码分析专家。请分析用户提供的Lua文件，提取其中的require语句和模块依赖关系。
+
+请分析这个文件并返回JSON格式的结果，包含以下信息：
+1. requires: 所有require语句中引用的模块名列表
+2. functions: 文件中定义的函数列表
+3. variables: 文件中定义的变量列表
+4. classes: 文件中定义的类或表结构
+5. comments: 重要的注释信息
+
+请确保返回的是有效的JSON格式，不要包含其他文本。"""
+
+_ANALYSIS_TEMPLATE = """文件路径: {path}
+文件内容:
+```
+{content}
+```"""
+
+_BATCH_ANALYSIS_SYSTEM = """你是一个Lua代码分析专家。请分别分析用户提供的多个Lua文件，提取每个文件中的require语句和模块依赖关系。
+
+请返回一个JSON数组，按文件编号顺序为每个文件给出一个对象，数组长度必须与文件数量一致。每个对象包含以下信息：
+1. requires: 所有require语句中引用的模块名列表
+2. functions: 文件中定义的函数列表
+3. variables: 文件中定义的变量列表
+4. classes: 文件中定义的类或表结构
+5. comments: 重要的注释信息
+
+请确保返回的是有效的JSON格式，不要包含其他文本。"""
+
+_BATCH_FILE_TEMPLATE = "=== FILE {index}: {path} ===\n{content}\n=== END FILE {index} ==="
+
+_BATCH_ANALYSIS_TEMPLATE = """以下共 {count} 个Lua文件，请返回长度为 {count} 的JSON数组。
+
+{files}"""
+
+_RESTORATION_SYSTEM = """你是一个Lua代码恢复专家。请将用户提供的可能是unluac反编译输出的内容恢复为可读的Lua源代码。
+
+请恢复为标准的Lua代码格式，要求：
+1. 保持原有的逻辑结构
+2. 添加适当的注释说明
+3. 使用清晰的变量和函数命名
+4. 遵循Lua代码规范
+5. 保持模块的完整性
+
+请只返回恢复后的Lua代码，不要包含其他解释文本。"""
+
+_RESTORATION_TEMPLATE = """文件路径: {path}
+依赖模块:
+{dependencies}
+
+原始内容:
+```
+{content}
+```"""
+
 
 class OpenRouterClient:
     """OpenRouter API客户端"""
     
-    def __init__(self, api_key: str, base_url: str = "https://openrouter.ai/api/v1", model: str = "anthropic/claude-3.5-sonnet"):
+    # 批量分析时单个请求中文件内容的token预算和最大文件数
+    BATCH_TOKEN_BUDGET = 3000
+    BATCH_MAX_FILES = 8
+    # 估算token数时使用的字符/token比例
+    CHARS_PER_TOKEN = 4
+    # 恢复结果会补充注释和更长的命名，篇幅可能接近输入的两倍，
+    # 恢复时每段输入不超过 max_tokens 的这一比例，避免输出被截断
+    RESTORE_OUTPUT_RATIO = 0.5
+    # 遇到限流、服务端错误或网络错误时的最大重试次数和退避基数（秒）
+    MAX_RETRIES = 3
+    RETRY_BACKOFF = 0.5
+    # 服务端通过Retry-After要求的等待时间上限（秒）
+    RETRY_AFTER_MAX = 60.0
+    RETRY_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+    
+    def __init__(self, api_key: str, base_url: str = "https://openrouter.ai/api/v1", model: str = "anthropic/claude-3.5-sonnet",
+                 max_tokens: int = 4000, temperature: float = 0.1, timeout: int = 60,
+                 cache_dir: Optional[str] = ".llm_cache", chunk_tokens: int = 8000, stream: bool = True,
+                 concurrency: int = 8, cache_ttl: Optional[float] = None):
         """
         初始化客户端
         
@@ -24,27 +113,53 @@ class OpenRouterClient:
             api_key: OpenRouter API密钥
             base_url: API基础URL
             model: 使用的模型名称
+            max_tokens: 单次响应的最大token数
+            temperature: 生成温度
+            timeout: 请求超时时间（秒）
+            cache_dir: 响应缓存目录，为None时不使用缓存
+            chunk_tokens: 单次请求中文件内容的token上限，超出时拆分为多段；
+                代码恢复时还会受 max_tokens 限制，保证输出不被截断
+            stream: 是否以流式（SSE）方式接收响应
+            concurrency: 异步调用时同时在途的最大请求数
+            cache_ttl: 缓存有效期（秒），为None或0时永不过期
         """
         self.api_key = api_key
         self.base_url = base_url
         self.model = model
-        self.session = requests.Session()
-        self.session.headers.update({
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.timeout = timeout
+        self.chunk_tokens = chunk_tokens
+        # 恢复请求的输出与输入篇幅相当，分段预算同时受响应的max_tokens限制
+        self.restore_chunk_tokens = max(1, min(chunk_tokens, int(max_tokens * self.RESTORE_OUTPUT_RATIO)))
+        self.stream = stream
+        self.concurrency = concurrency
+        self.headers = {
             "Authorization": f"Bearer {api_key}",
             "Content-Type": "application/json"
-        })
+        }
+        # HTTP/2 在同一连接上多路复用并发请求，省去重复的TCP/TLS握手；
+        # 连接池留足余量，避免并发请求在取连接时排队
+        self.limits = httpx.Limits(max_connections=64, max_keepalive_connections=32)
+        self.client = httpx.Client(http2=True, headers=self.headers, timeout=timeout, limits=self.limits)
+        # 异步客户端和请求信号量都绑定到运行中的事件循环，首次使用时再创建
+        self._async_client: Optional[httpx.AsyncClient] = None
+        self._request_semaphore: Optional[asyncio.Semaphore] = None
+        self.cache = LLMCache(cache_dir, ttl=cache_ttl) if cache_dir else None
         
-        # 设置日志
-        logging.basicConfig(level=logging.INFO)
+        # 日志由应用入口统一配置，这里只获取logger
         self.logger = logging.getLogger(__name__)
     
-    def analyze_lua_file(self, file_path: Path, content: str = None) -> Dict[str, Any]:
+    def analyze_lua_file(self, file_path: Path, content: str = None, use_cache: bool = True) -> Dict[str, Any]:
         """
         分析Lua文件，提取依赖关系
         
+        超出 chunk_tokens 预算的文件会按函数边界拆分后分段分析，再合并结果
+        
         Args:
             file_path: Lua文件路径
             content: 文件内容，如果为None则从文件读取
+            use_cache: 是否使用缓存的响应，为False时强制重新请求
             
         Returns:
             分析结果字典
@@ -57,160 +172,709 @@ class OpenRouterClient:
                 self.logger.error(f"读取文件 {file_path} 失败: {e}")
                 return {"error": str(e)}
         
-        prompt = self._build_analysis_prompt(file_path, content)
-        
-        try:
-            response = self._call_api(prompt)
-            return self._parse_analysis_response(response)
-        except Exception as e:
-            self.logger.error(f"分析文件 {file_path} 时出错: {e}")
-            return {"error": str(e)}
+        chunks = self._fit_to_budget(content, self.chunk_tokens)
+        results = [self._analyze_chunk(file_path, chunk, use_cache) for chunk in chunks]
+        return self._merge_analysis_results(results)
     
-    def restore_lua_code(self, file_path: Path, content: str, dependencies: List[str]) -> str:
+    def restore_lua_code(self, file_path: Path, content: str, dependencies: List[str], use_cache: bool = True) -> str:
         """
         使用LLM恢复Lua源代码
         
+        超出 restore_chunk_tokens 预算的文件会按函数边界拆分后分段恢复，再按顺序拼接
+        
         Args:
             file_path: 文件路径
             content: 原始内容（可能是unluac输出）
             dependencies: 依赖的模块列表
+            use_cache: 是否使用缓存的响应，为False时强制重新请求
             
         Returns:
             恢复后的Lua源代码
         """
+        chunks = self._fit_to_budget(content, self.restore_chunk_tokens)
+        restored = [self._restore_chunk(file_path, chunk, dependencies, use_cache) for chunk in chunks]
+        return self._join_restored_chunks(chunks, restored)
+    
+    async def aanalyze_lua_file(self, file_path: Path, content: str = None, use_cache: bool = True) -> Dict[str, Any]:
+        """
+        analyze_lua_file 的异步版本，各分段并发分析
+        
+        Args:
+            file_path: Lua文件路径
+            content: 文件内容，如果为None则从文件读取
+            use_cache: 是否使用缓存的响应，为False时强制重新请求
+            
+        Returns:
+            分析结果字典
+        """
+        if content is None:
+            try:
+                with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
+                    content = f.read()
+            except Exception as e:
+                self.logger.error(f"读取文件 {file_path} 失败: {e}")
+                return {"error": str(e)}
+        
+        chunks = self._fit_to_budget(content, self.chunk_tokens)
+        results = await asyncio.gather(*(self._aanalyze_chunk(file_path, chunk, use_cache) for chunk in chunks))
+        return self._merge_analysis_results(results)
+    
+    async def arestore_lua_code(self, file_path: Path, content: str, dependencies: List[str], use_cache: bool = True) -> str:
+        """
+        restore_lua_code 的异步版本，各分段并发恢复
+        
+        Args:
+            file_path: 文件路径
+            content: 原始内容（可能是unluac输出）
+            dependencies: 依赖的模块列表
+            use_cache: 是否使用缓存的响应，为False时强制重新请求
+            
+        Returns:
+            恢复后的Lua源代码
+        """
+        chunks = self._fit_to_budget(content, self.restore_chunk_tokens)
+        restored = await asyncio.gather(
+            *(self._arestore_chunk(file_path, chunk, dependencies, use_cache) for chunk in chunks)
+        )
+        return self._join_restored_chunks(chunks, restored)
+    
+    def _analyze_chunk(self, file_path: Path, content: str, use_cache: bool) -> Dict[str, Any]:
+        """分析单段内容"""
+        prompt = self._build_analysis_prompt(file_path, content)
+        
+        try:
+            return self._call_api(prompt, self._parse_single_analysis, use_cache, system=_ANALYSIS_SYSTEM)
+        except Exception as e:
+            self.logger.error(f"分析文件 {file_path} 时出错: {e}")
+            return {"error": str(e)}
+    
+    async def _aanalyze_chunk(self, file_path: Path, content: str, use_cache: bool) -> Dict[str, Any]:
+        """异步分析单段内容"""
+        prompt = self._build_analysis_prompt(file_path, content)
+        
+        try:
+            return await self._acall_api(prompt, self._parse_single_analysis, use_cache, system=_ANALYSIS_SYSTEM)
+        except Exception as e:
+            self.logger.error(f"分析文件 {file_path} 时出错: {e}")
+            return {"error": str(e)}
+    
+    def _restore_chunk(self, file_path: Path, content: str, dependencies: List[str], use_cache: bool) -> str:
+        """恢复单段内容"""
+        prompt = self._build_restoration_prompt(file_path, content, dependencies)
+        
+        try:
+            restored = self._call_api(prompt, self._parse_restoration_response, use_cache,
+                                       system=_RESTORATION_SYSTEM)
+            if not restored:
+                # 截断的代码不完整，保留该段原始内容
+                self.logger.warning(f"恢复文件 {file_path} 时响应为空或达到max_tokens上限被截断，保留原始内容")
+                return content
+            return restored
+        except Exception as e:
+            self.logger.error(f"恢复代码时出错: {e}")
+            return content  # 返回原始内容
+    
+    async def _arestore_chunk(self, file_path: Path, content: str, dependencies: List[str], use_cache: bool) -> str:
+        """异步恢复单段内容"""
         prompt = self._build_restoration_prompt(file_path, content, dependencies)
         
         try:
-            response = self._call_api(prompt)
-            return self._extract_code_from_response(response)
+            restored = await self._acall_api(prompt, self._parse_restoration_response, use_cache,
+                                             system=_RESTORATION_SYSTEM)
+            if not restored:
+                # 截断的代码不完整，保留该段原始内容
+                self.logger.warning(f"恢复文件 {file_path} 时响应为空或达到max_tokens上限被截断，保留原始内容")
+                return content
+            return restored
         except Exception as e:
             self.logger.error(f"恢复代码时出错: {e}")
             return content  # 返回原始内容
     
+    def _fit_to_budget(self, text: str, budget_tokens: int) -> List[str]:
+        """
+        将文本拆分为不超过token预算的若干段
+        
+        优先在顶层函数定义处切分；单个函数仍然超出预算时按行切分，
+        单行超出预算时按字符切分。各段按顺序拼接后与原文完全一致
+        
+        Args:
+            text: 原始文本
+            budget_tokens: 每段的token预算
+            
+        Returns:
+            拆分后的文本段列表
+        """
+        if self._estimate_tokens(text) <= budget_tokens:
+            return [text]
+        
+        budget_chars = budget_tokens * self.CHARS_PER_TOKEN
+        chunks = []
+        current = []
+        current_len = 0
+        
+        for piece in self._split_pieces(text, budget_chars):
+            if current and current_len + len(piece) > budget_chars:
+                chunks.append("".join(current))
+                current = []
+                current_len = 0
+            current.append(piece)
+            current_len += len(piece)
+        
+        if current:
+            chunks.append("".join(current))
+        return chunks
+    
+    @staticmethod
+    def _split_pieces(text: str, budget_chars: int):
+        """按函数边界、行、字符的顺序逐级切分，生成不超过预算的片段"""
+        for segment in _FUNCTION_BOUNDARY_RE.split(text):
+            if len(segment) <= budget_chars:
+                yield segment
+                continue
+            for line in segment.splitlines(keepends=True):
+                for start in range(0, len(line), budget_chars):
+                    yield line[start:start + budget_chars]
+    
+    @staticmethod
+    def _merge_analysis_results(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """合并分段分析结果，任一分段失败或结果不是JSON对象则返回错误"""
+        results = [
+            result if isinstance(result, dict) else {"error": f"分析结果不是JSON对象: {type(result).__name__}"}
+            for result in results
+        ]
+        if len(results) == 1:
+            return results[0]
+        
+        merged: Dict[str, Any] = {}
+        for result in results:
+            if 'error' in result:
+                return result
+            for key, value in result.items():
+                if isinstance(value, list) and isinstance(merged.get(key, []), list):
+                    items = merged.setdefault(key, [])
+                    items.extend(item for item in value if item not in items)
+                else:
+                    merged.setdefault(key, value)
+        return merged
+    
+    @staticmethod
+    def _join_restored_chunks(chunks: List[str], restored: List[str]) -> str:
+        """按顺序拼接分段恢复结果，某段恢复结果为空时使用该段原始内容"""
+        if len(chunks) == 1:
+            return restored[0]
+        return "\n\n".join(code or chunk for chunk, code in zip(chunks, restored))
+    
+    async def analyze_many(self, files: List[Tuple[Path, Optional[str]]], concurrency: int = 8) -> List[Dict[str, Any]]:
+        """
+        并发分析多个Lua文件
+        
+        Args:
+            files: (文件路径, 文件内容) 列表，内容为None时从文件读取
+            concurrency: 同时进行的最大请求数
+            
+        Returns:
+            与输入顺序一致的分析结果列表
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+        
+        async def analyze_one(file_path: Path, content: Optional[str]) -> Dict[str, Any]:
+            async with semaphore:
+                return await self.aanalyze_lua_file(file_path, content)
+        
+        tasks = [analyze_one(file_path, content) for file_path, content in files]
+        return await asyncio.gather(*tasks)
+    
+    def analyze_lua_files(self, items: List[Tuple[Path, str]], token_budget: int = None,
+                          use_cache: bool = True) -> List[Dict[str, Any]]:
+        """
+        批量分析多个Lua文件，多个小文件合并到同一个请求中
+        
+        Args:
+            items: (文件路径, 文件内容) 列表
+            token_budget: 单个请求中文件内容的token预算，默认为 BATCH_TOKEN_BUDGET
+            use_cache: 是否使用缓存的响应，为False时强制重新请求
+            
+        Returns:
+            与输入顺序一致的分析结果列表
+        """
+        results = []
+        for batch in self._group_by_token_budget(items, token_budget or self.BATCH_TOKEN_BUDGET):
+            if len(batch) == 1:
+                file_path, content = batch[0]
+                results.append(self.analyze_lua_file(file_path, content, use_cache))
+                continue
+            
+            prompt = self._build_batch_analysis_prompt(batch)
+            try:
+                batch_results = self._call_api(
+                    prompt, lambda response: self._parse_batch_analysis_response(response, len(batch)),
+                    use_cache, system=_BATCH_ANALYSIS_SYSTEM
+                )
+            except Exception as e:
+                self.logger.error(f"批量分析 {len(batch)} 个文件时出错: {e}")
+                batch_results = None
+            
+            if self._batch_failed(batch_results):
+                # 批量结果不可用时逐个分析
+                self.logger.warning(f"批量分析失败，改为逐个分析 {len(batch)} 个文件")
+                batch_results = [self.analyze_lua_file(file_path, content, use_cache)
+                                 for file_path, content in batch]
+            results.extend(batch_results)
+        
+        return results
+    
+    async def aanalyze_lua_files(self, items: List[Tuple[Path, str]], token_budget: int = None,
+                                 concurrency: int = 8, use_cache: bool = True,
+                                 on_done: Optional[Callable[[int], Any]] = None) -> List[Dict[str, Any]]:
+        """
+        analyze_lua_files 的异步版本，各批次并发请求
+        
+        Args:
+            items: (文件路径, 文件内容) 列表
+            token_budget: 单个请求中文件内容的token预算，默认为 BATCH_TOKEN_BUDGET
+            concurrency: 同时进行的最大请求数
+            use_cache: 是否使用缓存的响应，为False时强制重新请求
+            on_done: 每完成一个批次时以该批次的文件数调用，可用于更新进度
+            
+        Returns:
+            与输入顺序一致的分析结果列表
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+        
+        async def analyze_batch(batch: List[Tuple[Path, str]]) -> List[Dict[str, Any]]:
+            async with semaphore:
+                batch_results = await analyze_batch_once(batch)
+            if on_done is not None:
+                on_done(len(batch))
+            return batch_results
+        
+        async def analyze_batch_once(batch: List[Tuple[Path, str]]) -> List[Dict[str, Any]]:
+            if len(batch) == 1:
+                file_path, content = batch[0]
+                return [await self.aanalyze_lua_file(file_path, content, use_cache)]
+            
+            prompt = self._build_batch_analysis_prompt(batch)
+            try:
+                batch_results = await self._acall_api(
+                    prompt, lambda response: self._parse_batch_analysis_response(response, len(batch)),
+                    use_cache, system=_BATCH_ANALYSIS_SYSTEM
+                )
+            except Exception as e:
+                self.logger.error(f"批量分析 {len(batch)} 个文件时出错: {e}")
+                batch_results = None
+            
+            if self._batch_failed(batch_results):
+                # 批量结果不可用时逐个并发分析
+                self.logger.warning(f"批量分析失败，改为逐个分析 {len(batch)} 个文件")
+                batch_results = await asyncio.gather(
+                    *(self.aanalyze_lua_file(file_path, content, use_cache) for file_path, content in batch)
+                )
+            return batch_results
+        
+        batches = self._group_by_token_budget(items, token_budget or self.BATCH_TOKEN_BUDGET)
+        batch_results = await asyncio.gather(*(analyze_batch(batch) for batch in batches))
+        return [result for results in batch_results for result in results]
+    
+    @staticmethod
+    def _batch_failed(batch_results: Optional[List[Dict[str, Any]]]) -> bool:
+        """批量请求出错，或响应无法按文件拆分（每个结果都是错误）"""
+        return batch_results is None or all('error' in result for result in batch_results)
+    
+    def _estimate_tokens(self, text: str) -> int:
+        """按字符数粗略估算token数"""
+        return len(text) // self.CHARS_PER_TOKEN + 1
+    
+    def _group_by_token_budget(self, items: List[Tuple[Path, str]], token_budget: int) -> List[List[Tuple[Path, str]]]:
+        """
+        按token预算将文件分组，每组最多 BATCH_MAX_FILES 个文件，保持输入顺序，超出预算的单个文件独占一组
+        
+        Args:
+            items: (文件路径, 文件内容) 列表
+            token_budget: 每组文件内容的token预算
+            
+        Returns:
+            分组后的列表
+        """
+        batches = []
+        current_batch = []
+        current_tokens = 0
+        
+        for file_path, content in items:
+            tokens = self._estimate_tokens(str(file_path)) + self._estimate_tokens(content)
+            if current_batch and (current_tokens + tokens > token_budget
+                                  or len(current_batch) >= self.BATCH_MAX_FILES):
+                batches.append(current_batch)
+                current_batch = []
+                current_tokens = 0
+            current_batch.append((file_path, content))
+            current_tokens += tokens
+        
+        if current_batch:
+            batches.append(current_batch)
+        return batches
+    
     def _build_analysis_prompt(self, file_path: Path, content: str) -> str:
-        """构建分析提示词"""
-        return f"""你是一个Lua代码分析专家。请分析以下Lua文件，提取其中的require语句和模块依赖关系。
+        """构建分析请求的用户提示词"""
+        return _ANALYSIS_TEMPLATE.format(path=file_path, content=content)
 
-文件路径: {file_path}
-文件内容:
-```
-{content}
-```
-
-请分析这个文件并返回JSON格式的结果，包含以下信息：
-1. requires: 所有require语句中引用的模块名列表
-2. functions: 文件中定义的函数列表
-3. variables: 文件中定义的变量列表
-4. classes: 文件中定义的类或表结构
-5. comments: 重要的注释信息
-
-请确保返回的是有效的JSON格式，不要包含其他文本。"""
+    def _build_batch_analysis_prompt(self, items: List[Tuple[Path, str]]) -> str:
+        """构建批量分析请求的用户提示词"""
+        files_str = "\n".join(
+            _BATCH_FILE_TEMPLATE.format(index=index, path=file_path, content=content)
+            for index, (file_path, content) in enumerate(items, 1)
+        )
+        return _BATCH_ANALYSIS_TEMPLATE.format(count=len(items), files=files_str)
 
     def _build_restoration_prompt(self, file_path: Path, content: str, dependencies: List[str]) -> str:
-        """构建代码恢复提示词"""
-        deps_str = "\n".join([f"- {dep}" for dep in dependencies])
-        
-        return f"""你是一个Lua代码恢复专家。请将以下可能是unluac反编译输出的内容恢复为可读的Lua源代码。
-
-文件路径: {file_path}
-依赖模块:
-{deps_str}
-
-原始内容:
-```
-{content}
-```
-
-请恢复为标准的Lua代码格式，要求：
-1. 保持原有的逻辑结构
-2. 添加适当的注释说明
-3. 使用清晰的变量和函数命名
-4. 遵循Lua代码规范
-5. 保持模块的完整性
+        """构建代码恢复请求的用户提示词"""
+        deps_str = "\n".join(f"- {dep}" for dep in dependencies)
+        return _RESTORATION_TEMPLATE.format(path=file_path, dependencies=deps_str, content=content)
 
-请只返回恢复后的Lua代码，不要包含其他解释文本。"""
-
-    def _call_api(self, prompt: str) -> Dict[str, Any]:
-        """调用OpenRouter API"""
-        payload = {
+    def _build_payload(self, prompt: str, system: Optional[str] = None) -> Dict[str, Any]:
+        """构建请求体，系统提示词标记为可缓存的前缀"""
+        messages = []
+        if system:
+            messages.append({
+                "role": "system",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": system,
+                        "cache_control": {"type": "ephemeral"}
+                    }
+                ]
+            })
+        messages.append({
+            "role": "user",
+            "content": prompt
+        })
+        return {
             "model": self.model,
-            "messages": [
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
-            "max_tokens": 4000,
-            "temperature": 0.1
+            "messages": messages,
+            "max_tokens": self.max_tokens,
+            "temperature": self.temperature,
+            "stream": self.stream
         }
+    
+    def _cache_lookup(self, prompt: str, use_cache: bool,
+                      system: Optional[str] = None) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+        """
+        查询响应缓存
         
+        Returns:
+            (缓存键, 命中的响应)，未启用缓存时键为None
+        """
+        if self.cache is None:
+            return None, None
+        
+        # 系统提示词同样影响响应，一并计入缓存键
+        key = self.cache.make_key(self.model, f"{system}\n{prompt}" if system else prompt)
+        if not use_cache:
+            return key, None
+        return key, self.cache.get(key)
+    
+    def _cache_store(self, key: Optional[str], result: Dict[str, Any]):
+        """缓存内容完整的API响应，调用方应在响应解析成功后再调用"""
+        if key is None:
+            return
         try:
-            response = self.session.post(
-                f"{self.base_url}/chat/completions",
-                json=payload,
-                timeout=60
-            )
+            has_content = bool(result["choices"][0]["message"]["content"])
+        except (KeyError, IndexError, TypeError):
+            has_content = False
+        # 被max_tokens截断的响应不完整，不写入缓存
+        if has_content and not self._is_truncated(result):
+            self.cache.set(key, result)
+    
+    @staticmethod
+    def _is_truncated(response: Dict[str, Any]) -> bool:
+        """响应是否因达到max_tokens上限而被截断"""
+        try:
+            return response["choices"][0].get("finish_reason") == "length"
+        except (KeyError, IndexError, TypeError, AttributeError):
+            return False
+    
+    @staticmethod
+    def _parse_succeeded(parsed: Any) -> bool:
+        """解析结果是否可用：非空，且不是（也不包含）错误结果"""
+        if isinstance(parsed, list):
+            return bool(parsed) and all(OpenRouterClient._parse_succeeded(item) for item in parsed)
+        if isinstance(parsed, dict):
+            return 'error' not in parsed
+        return bool(parsed)
+    
+    def _call_api(self, prompt: str, parse: Callable[[Dict[str, Any]], Any], use_cache: bool = True,
+                  system: Optional[str] = None) -> Any:
+        """
+        调用OpenRouter API并解析响应
+        
+        只有解析成功的响应才会写入缓存，解析失败的请求下次仍会重新发起
+        
+        Args:
+            prompt: 用户提示词
+            parse: 将响应解析为结果的函数
+            use_cache: 是否使用缓存的响应
+            system: 系统提示词
+            
+        Returns:
+            parse 的返回值
+        """
+        key, hit = self._cache_lookup(prompt, use_cache, system)
+        if hit is not None:
+            parsed = parse(hit)
+            if self._parse_succeeded(parsed):
+                return parsed
+            # 早期版本缓存的无效响应，重新请求
+        
+        payload = self._build_payload(prompt, system)
+        
+        for attempt in range(self.MAX_RETRIES + 1):
+            try:
+                result = self._send(payload)
+                break
+            except httpx.HTTPError as e:
+                if attempt < self.MAX_RETRIES and self._should_retry(e):
+                    delay = self._retry_delay(attempt, e)
+                    self.logger.warning(f"API调用失败，{delay:.1f}秒后重试: {e}")
+                    time.sleep(delay)
+                    continue
+                self.logger.error(f"API调用失败: {e}")
+                raise
+        
+        parsed = parse(result)
+        if self._parse_succeeded(parsed):
+            self._cache_store(key, result)
+        return parsed
+    
+    def _send(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """发送一次请求并解析响应"""
+        with self.client.stream("POST", f"{self.base_url}/chat/completions", content=orjson.dumps(payload)) as response:
             response.raise_for_status()
             
-            result = response.json()
-            return result
+            if self.stream:
+                # 边接收边解析增量内容
+                parts: List[str] = []
+                result: Dict[str, Any] = {}
+                for line in response.iter_lines():
+                    if self._parse_stream_line(line, parts, result):
+                        break
+                return self._finish_stream(parts, result)
             
-        except requests.exceptions.RequestException as e:
-            self.logger.error(f"API调用失败: {e}")
-            raise
+            return orjson.loads(response.read())
+    
+    def _should_retry(self, error: httpx.HTTPError) -> bool:
+        """限流（429）、服务端临时错误（5xx）和网络错误（连接失败、超时、流中断）值得重试"""
+        if isinstance(error, httpx.TransportError):
+            return True
+        return (isinstance(error, httpx.HTTPStatusError)
+                and error.response.status_code in self.RETRY_STATUS_CODES)
+    
+    def _retry_delay(self, attempt: int, error: Optional[httpx.HTTPError] = None) -> float:
+        """
+        第 attempt 次重试前的等待时间
+        
+        响应带有Retry-After头时按其要求等待（不超过 RETRY_AFTER_MAX），否则按指数退避
+        """
+        if isinstance(error, httpx.HTTPStatusError):
+            retry_after = self._parse_retry_after(error.response.headers.get("Retry-After"))
+            if retry_after is not None:
+                return min(retry_after, self.RETRY_AFTER_MAX)
+        return self.RETRY_BACKOFF * (2 ** attempt)
+    
+    @staticmethod
+    def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+        """解析Retry-After头，支持秒数和HTTP日期两种格式，无法解析时返回None"""
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            when = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        if when.tzinfo is None:
+            when = when.replace(tzinfo=timezone.utc)
+        return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+    
+    def _get_async_client(self) -> httpx.AsyncClient:
+        """获取（必要时创建）异步客户端，必须在事件循环中调用"""
+        if self._async_client is None or self._async_client.is_closed:
+            self._async_client = httpx.AsyncClient(http2=True, headers=self.headers,
+                                                   timeout=self.timeout, limits=self.limits)
+            self._request_semaphore = asyncio.Semaphore(self.concurrency)
+        return self._async_client
+    
+    async def _acall_api(self, prompt: str, parse: Callable[[Dict[str, Any]], Any], use_cache: bool = True,
+                         system: Optional[str] = None) -> Any:
+        """_call_api 的异步版本"""
+        key, hit = self._cache_lookup(prompt, use_cache, system)
+        if hit is not None:
+            parsed = parse(hit)
+            if self._parse_succeeded(parsed):
+                return parsed
+            # 早期版本缓存的无效响应，重新请求
+        
+        payload = self._build_payload(prompt, system)
+        client = self._get_async_client()
+        
+        for attempt in range(self.MAX_RETRIES + 1):
+            try:
+                # 在请求层面限流：超大文件拆出的分段请求也计入并发数
+                async with self._request_semaphore:
+                    result = await self._asend(client, payload)
+                break
+            except httpx.HTTPError as e:
+                if attempt < self.MAX_RETRIES and self._should_retry(e):
+                    delay = self._retry_delay(attempt, e)
+                    self.logger.warning(f"API调用失败，{delay:.1f}秒后重试: {e}")
+                    await asyncio.sleep(delay)
+                    continue
+                self.logger.error(f"API调用失败: {e}")
+                raise
+        
+        parsed = parse(result)
+        if self._parse_succeeded(parsed):
+            self._cache_store(key, result)
+        return parsed
+    
+    async def _asend(self, client: httpx.AsyncClient, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """异步发送一次请求并解析响应"""
+        async with client.stream("POST", f"{self.base_url}/chat/completions", content=orjson.dumps(payload)) as response:
+            response.raise_for_status()
+            
+            if self.stream:
+                # 边接收边解析增量内容
+                parts: List[str] = []
+                result: Dict[str, Any] = {}
+                async for line in response.aiter_lines():
+                    if self._parse_stream_line(line, parts, result):
+                        break
+                return self._finish_stream(parts, result)
+            
+            return orjson.loads(await response.aread())
+    
+    def _parse_stream_line(self, line: str, parts: List[str], result: Dict[str, Any]) -> bool:
+        """
+        处理SSE流中的一行，收集增量生成的内容
+        
+        Args:
+            line: SSE行
+            parts: 已收到的内容片段，原地追加
+            result: 响应元数据（id、model、usage、finish_reason），原地更新
+            
+        Returns:
+            收到结束标记时返回True
+        """
+        # 空行和注释行（如 ": OPENROUTER PROCESSING"）不携带数据
+        if not line.startswith("data:"):
+            return False
+        
+        data = line[5:].strip()
+        if data == "[DONE]":
+            return True
+        
+        chunk = orjson.loads(data)
+        if "error" in chunk:
+            raise RuntimeError(f"流式响应返回错误: {chunk['error']}")
+        
+        for key in ("id", "model", "usage"):
+            if chunk.get(key) is not None:
+                result[key] = chunk[key]
+        
+        choices = chunk.get("choices") or []
+        if choices:
+            content = (choices[0].get("delta") or {}).get("content")
+            if content:
+                parts.append(content)
+            if choices[0].get("finish_reason"):
+                result["finish_reason"] = choices[0]["finish_reason"]
+        return False
+    
+    @staticmethod
+    def _finish_stream(parts: List[str], result: Dict[str, Any]) -> Dict[str, Any]:
+        """将流式片段组装为与非流式响应相同的结构"""
+        result["choices"] = [{
+            "message": {"role": "assistant", "content": "".join(parts)},
+            "finish_reason": result.pop("finish_reason", None)
+        }]
+        return result
+    
+    async def aclose(self):
+        """关闭异步客户端"""
+        if self._async_client is not None and not self._async_client.is_closed:
+            await self._async_client.aclose()
+        self._async_client = None
+        self._request_semaphore = None
     
     def _parse_analysis_response(self, response: Dict[str, Any]) -> Dict[str, Any]:
         """解析分析响应"""
+        content = None
         try:
             content = response["choices"][0]["message"]["content"]
             
             # 尝试提取JSON
-            if "```json" in content:
-                json_start = content.find("```json") + 7
-                json_end = content.find("```", json_start)
-                json_str = content[json_start:json_end].strip()
-            elif "```" in content:
-                json_start = content.find("```") + 3
-                json_end = content.find("```", json_start)
-                json_str = content[json_start:json_end].strip()
-            else:
-                json_str = content.strip()
+            json_str = self._extract_code_block(content)
             
             # 移除可能的"json"标记
             if json_str.startswith("json"):
                 json_str = json_str[4:].strip()
             
-            return json.loads(json_str)
+            return orjson.loads(json_str)
             
-        except (KeyError, json.JSONDecodeError) as e:
+        except (KeyError, IndexError, TypeError, orjson.JSONDecodeError) as e:
             self.logger.error(f"解析响应失败: {e}")
             return {"error": f"解析失败: {e}", "raw_content": content}
     
+    def _parse_single_analysis(self, response: Dict[str, Any]) -> Dict[str, Any]:
+        """解析单个文件的分析响应，结果不是JSON对象时返回错误"""
+        parsed = self._parse_analysis_response(response)
+        if not isinstance(parsed, dict):
+            return {"error": f"分析结果不是JSON对象: {type(parsed).__name__}"}
+        return parsed
+    
+    def _parse_batch_analysis_response(self, response: Dict[str, Any], count: int) -> List[Dict[str, Any]]:
+        """解析批量分析响应，结果数量与批次大小不符时每个文件都返回错误"""
+        parsed = self._parse_analysis_response(response)
+        
+        if isinstance(parsed, list) and len(parsed) == count and all(isinstance(item, dict) for item in parsed):
+            return parsed
+        
+        if isinstance(parsed, dict) and 'error' in parsed:
+            error = parsed['error']
+        else:
+            error = f"批量分析结果数量不匹配: 期望 {count} 个对象"
+        self.logger.error(error)
+        return [{"error": error} for _ in range(count)]
+    
+    def _parse_restoration_response(self, response: Dict[str, Any]) -> str:
+        """解析代码恢复响应，响应被max_tokens截断时返回空字符串"""
+        if self._is_truncated(response):
+            return ""
+        return self._extract_code_from_response(response)
+    
     def _extract_code_from_response(self, response: Dict[str, Any]) -> str:
         """从响应中提取代码"""
         try:
             content = response["choices"][0]["message"]["content"]
             
             # 尝试提取代码块
-            if "```lua" in content:
-                code_start = content.find("```lua") + 6
-                code_end = content.find("```", code_start)
-                return content[code_start:code_end].strip()
-            elif "```" in content:
-                code_start = content.find("```") + 3
-                code_end = content.find("```", code_start)
-                return content[code_start:code_end].strip()
-            else:
-                return content.strip()
+            return self._extract_code_block(content)
                 
-        except (KeyError, IndexError) as e:
+        except (KeyError, IndexError, TypeError) as e:
             self.logger.error(f"提取代码失败: {e}")
             return ""
 
+    @staticmethod
+    def _extract_code_block(content: str) -> str:
+        """提取代码块的内容，优先取标注了lua/json的代码块，没有代码块时返回整个文本"""
+        match = _TAGGED_CODE_BLOCK_RE.search(content) or _CODE_BLOCK_RE.search(content)
+        return match.group(1).strip() if match else content.strip()
+    
     def test_connection(self) -> bool:
         """测试API连接"""
         try:
-            response = self.session.get(f"{self.base_url}/models")
+            response = self.client.get(f"{self.base_url}/models")
             return response.status_code == 200
         except Exception as e:
             self.logger.error(f"连接测试失败: {e}")
@@ -229,4 +893,5 @@ def test_client():
 
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
     test_client()
@@ -7,14 +7,32 @@ Lua解码器主类
 
 import os
 import sys
+import asyncio
+import hashlib
 import yaml
+import orjson
 import logging
+import logging.handlers
 from pathlib import Path
 from typing import Dict, List, Set, Optional, Any
+from functools import lru_cache
 from tqdm import tqdm
+from tqdm.asyncio import tqdm_asyncio
 import colorama
 from colorama import Fore, Style
 
+# 优先使用libyaml的C实现，未编译libyaml时退回纯Python解析器
+try:
+    from yaml import CSafeLoader as YamlLoader
+except ImportError:
+    from yaml import SafeLoader as YamlLoader
+
+# 内容摘要优先使用blake3，未安装时退回标准库的blake2b
+try:
+    from blake3 import blake3 as _content_hasher
+except ImportError:
+    _content_hasher = hashlib.blake2b
+
 from lua_module_resolver import LuaModuleResolver
 from llm_client import OpenRouterClient
 from dependency_graph import DependencyGraph
@@ -42,11 +60,29 @@ class LuaDecoder:
         
         # 初始化组件
         self.resolver = LuaModuleResolver(self.config.get('lua_paths', []))
+        llm_config = self.config.get('llm', {})
         self.llm_client = OpenRouterClient(
             api_key=self.config['openrouter']['api_key'],
             base_url=self.config['openrouter']['base_url'],
-            model=self.config['openrouter']['model']
+            model=self.config['openrouter']['model'],
+            max_tokens=llm_config.get('max_tokens', 4000),
+            temperature=llm_config.get('temperature', 0.1),
+            timeout=llm_config.get('timeout', 60),
+            cache_dir=llm_config.get('cache_dir', '.llm_cache'),
+            cache_ttl=llm_config.get('cache_ttl'),
+            chunk_tokens=llm_config.get('chunk_tokens', 8000),
+            stream=llm_config.get('stream', True),
+            concurrency=llm_config.get('concurrency', 8)
         )
+        # 同时进行的最大LLM请求数
+        self.concurrency = llm_config.get('concurrency', 8)
+        # 是否将多个小文件合并到同一个依赖分析请求中
+        self.batch_analysis = llm_config.get('batch_analysis', True)
+        # 读取文件、解析模块路径等本地IO使用的线程数
+        self.max_workers = self.config.get('max_workers', 16)
+        # 正则无法确定依赖时是否交给LLM分析，以及无require的文件超过多少字符时交给LLM
+        self.llm_dep_fallback = self.config.get('llm_dep_fallback', True)
+        self.llm_dep_threshold = self.config.get('llm_dep_threshold', 1024)
         self.dependency_graph = DependencyGraph()
         
         # 状态跟踪
@@ -54,27 +90,48 @@ class LuaDecoder:
         self.failed_files = set()
         self.restored_files = set()
         
+        # 上次运行的分析结果清单：文件绝对路径 -> {hash, requires, module}
+        self.manifest: Dict[str, Dict[str, Any]] = {}
+        # 本次运行中LLM的分析结果：内容摘要 -> 分析结果，内容相同的文件不再重复请求
+        self.analysis_by_hash: Dict[str, Dict[str, Any]] = {}
+        
         self.logger.info("Lua解码器初始化完成")
     
     def _setup_logging(self):
-        """设置日志系统"""
+        """
+        设置日志系统
+        
+        日志级别可通过环境变量 LOG_LEVEL 覆盖（如 DEBUG、WARNING），
+        根logger已配置过时直接返回，不会重复打开日志文件
+        """
+        if logging.getLogger().handlers:
+            return
+        
         log_dir = Path("logs")
         log_dir.mkdir(exist_ok=True)
+        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+        
+        # 文件日志先缓存在内存中批量写入，遇到ERROR或退出时立即刷新
+        file_handler = logging.FileHandler(log_dir / "lua_decoder.log", encoding='utf-8')
+        file_handler.setFormatter(formatter)
+        memory_handler = logging.handlers.MemoryHandler(
+            capacity=1024, flushLevel=logging.ERROR, target=file_handler
+        )
+        stream_handler = logging.StreamHandler(sys.stdout)
+        stream_handler.setFormatter(formatter)
         
         logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-            handlers=[
-                logging.FileHandler(log_dir / "lua_decoder.log", encoding='utf-8'),
-                logging.StreamHandler(sys.stdout)
-            ]
+            level=os.environ.get("LOG_LEVEL", "INFO").upper(),
+            handlers=[memory_handler, stream_handler]
         )
+        # httpx每个请求都会输出一条INFO日志，只保留警告及以上
+        logging.getLogger("httpx").setLevel(logging.WARNING)
     
     def _load_config(self, config_file: str) -> Dict[str, Any]:
         """加载配置文件"""
         try:
             with open(config_file, 'r', encoding='utf-8') as f:
-                config = yaml.safe_load(f)
+                config = yaml.load(f, Loader=YamlLoader)
             
             # 验证必要的配置
             required_keys = ['openrouter.api_key', 'openrouter.base_url', 'openrouter.model']
@@ -101,7 +158,7 @@ class LuaDecoder:
     
     def analyze_file_dependencies(self, file_path: Path) -> Dict[str, Any]:
         """
-        分析文件的依赖关系
+        分析文件的依赖关系（aanalyze_files 的同步封装）
         
         Args:
             file_path: 要分析的文件路径
@@ -109,22 +166,138 @@ class LuaDecoder:
         Returns:
             分析结果字典
         """
-        self.logger.info(f"开始分析文件依赖: {file_path}")
+        return self._run_sync(self.aanalyze_files([file_path]))[0]
+    
+    async def aanalyze_files(self, file_paths: List[Path]) -> List[Dict[str, Any]]:
+        """
+        并发分析一组文件的依赖关系
         
-        try:
-            # 读取文件内容
-            with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                content = f.read()
+        Args:
+            file_paths: 要分析的文件路径列表
             
-            # 使用LLM分析依赖
-            analysis_result = self.llm_client.analyze_lua_file(file_path, content)
+        Returns:
+            与输入顺序一致的分析结果列表
+        """
+        results: List[Optional[Dict[str, Any]]] = [None] * len(file_paths)
+        pending = []  # 需要LLM分析的 (下标, 文件路径, 文件内容, 内容摘要)
+        duplicates = []  # 与pending中某个文件内容相同的文件，复用其分析结果
+        pending_digests = set()
+        
+        # 并行读取本层所有文件
+        contents = self.dependency_graph.read_files(file_paths, workers=self.max_workers)
+        
+        for index, (file_path, (content, error)) in enumerate(zip(file_paths, contents)):
+            self.logger.debug(f"开始分析文件依赖: {file_path}")
+            if error is not None:
+                self.logger.error(f"分析文件 {file_path} 时出错: {error}")
+                self.failed_files.add(str(file_path))
+                results[index] = {"error": error}
+                continue
             
-            if 'error' in analysis_result:
-                self.logger.error(f"分析文件 {file_path} 失败: {analysis_result['error']}")
-                return analysis_result
+            # 内容未变化的文件直接复用上次的分析结果，
+            # 否则先用正则提取依赖，能确定结果时不再调用LLM
+            digest = self._content_hash(content)
+            analysis_result = self._manifest_analysis(file_path, digest)
+            if analysis_result is None:
+                analysis_result = self._regex_analysis(content)
+            if analysis_result is None:
+                analysis_result = self.analysis_by_hash.get(digest)
+            if analysis_result is None:
+                if digest in pending_digests:
+                    duplicates.append((index, file_path, content, digest))
+                else:
+                    pending_digests.add(digest)
+                    pending.append((index, file_path, content, digest))
+            else:
+                results[index] = self._record_analysis(file_path, content, analysis_result, digest)
+        
+        # 使用LLM并发分析依赖，客户端按请求限制同时在途的数量
+        if self.batch_analysis:
+            # 小文件按token预算合并为批次请求，批次失败时客户端会逐个重试
+            with tqdm(total=len(pending), desc="分析文件", unit="文件", leave=False) as pbar:
+                analysis_results = await self.llm_client.aanalyze_lua_files(
+                    [(file_path, content) for _, file_path, content, _ in pending],
+                    concurrency=self.concurrency,
+                    on_done=pbar.update
+                )
+        else:
+            analysis_results = await tqdm_asyncio.gather(
+                *(self.llm_client.aanalyze_lua_file(file_path, content) for _, file_path, content, _ in pending),
+                desc="分析文件", unit="文件", leave=False
+            )
+        
+        batch_results = {}
+        for (index, file_path, content, digest), analysis_result in zip(pending, analysis_results):
+            batch_results[digest] = analysis_result
+            if 'error' not in analysis_result:
+                self.analysis_by_hash[digest] = analysis_result
+            results[index] = self._record_analysis(file_path, content, analysis_result, digest)
+        
+        for index, file_path, content, digest in duplicates:
+            results[index] = self._record_analysis(file_path, content, batch_results[digest], digest)
+        
+        return results
+    
+    @staticmethod
+    def _content_hash(content: str) -> str:
+        """计算文件内容摘要"""
+        return _content_hasher(content.encode('utf-8')).hexdigest()
+    
+    def _manifest_analysis(self, file_path: Path, digest: str) -> Optional[Dict[str, Any]]:
+        """内容摘要与清单一致时返回上次的分析结果，否则返回None"""
+        entry = self.manifest.get(os.path.abspath(file_path))
+        if entry is None or entry.get('hash') != digest:
+            return None
+        return {"requires": entry.get('requires', []), "source": "manifest"}
+    
+    def _load_manifest(self, manifest_file: Path):
+        """加载上次运行的分析结果清单"""
+        if not manifest_file.exists():
+            return
+        try:
+            self.manifest = orjson.loads(manifest_file.read_bytes())
+            self.logger.info(f"已加载分析清单: {manifest_file}（{len(self.manifest)} 个文件）")
+        except (OSError, orjson.JSONDecodeError) as e:
+            self.logger.warning(f"加载分析清单失败，将重新分析: {e}")
+            self.manifest = {}
+    
+    def _save_manifest(self, manifest_file: Path):
+        """保存分析结果清单，供下次运行跳过未变化的文件"""
+        try:
+            manifest_file.parent.mkdir(parents=True, exist_ok=True)
+            tmp_file = manifest_file.with_suffix('.tmp')
+            tmp_file.write_bytes(orjson.dumps(self.manifest, option=orjson.OPT_INDENT_2))
+            tmp_file.replace(manifest_file)
+        except OSError as e:
+            self.logger.warning(f"保存分析清单失败: {e}")
+    
+    def _regex_analysis(self, content: str) -> Optional[Dict[str, Any]]:
+        """
+        用正则提取文件依赖
+        
+        Args:
+            content: 文件内容
             
+        Returns:
+            分析结果；存在无法静态解析的require，或文件较大却没有匹配到require时
+            返回None，表示需要交给LLM分析（未启用LLM兜底时总是返回正则结果）
+        """
+        requires, complete = self.resolver.scan_requires(content)
+        if self.llm_dep_fallback:
+            if not complete or (not requires and len(content) > self.llm_dep_threshold):
+                return None
+        return {"requires": requires, "source": "regex"}
+    
+    def _record_analysis(self, file_path: Path, content: str, analysis_result: Dict[str, Any],
+                         digest: str = None) -> Dict[str, Any]:
+        """将单个文件的分析结果写入依赖图，给出内容摘要时同时记入清单"""
+        if 'error' in analysis_result:
+            self.logger.error(f"分析文件 {file_path} 失败: {analysis_result['error']}")
+            return analysis_result
+        
+        try:
             # 添加到依赖图
-            module_name = self._extract_module_name(file_path)
+            module_name = self._extract_module_name(os.fspath(file_path))
             self.dependency_graph.add_file(file_path, module_name, content)
             
             # 处理依赖关系
@@ -135,11 +308,17 @@ class LuaDecoder:
                 # 尝试解析依赖模块的文件路径
                 dep_file = self.resolver.resolve_module_to_path(req_module)
                 if dep_file and dep_file.exists():
-                    self.logger.info(f"找到依赖模块文件: {req_module} -> {dep_file}")
+                    self.logger.debug(f"找到依赖模块文件: {req_module} -> {dep_file}")
                 else:
                     self.logger.warning(f"未找到依赖模块文件: {req_module}")
             
             self.processed_files.add(str(file_path))
+            if digest is not None:
+                self.manifest[os.path.abspath(file_path)] = {
+                    "hash": digest,
+                    "requires": requires,
+                    "module": module_name
+                }
             return analysis_result
             
         except Exception as e:
@@ -147,8 +326,11 @@ class LuaDecoder:
             self.failed_files.add(str(file_path))
             return {"error": str(e)}
     
-    def _extract_module_name(self, file_path: Path) -> str:
-        """从文件路径提取模块名"""
+    @staticmethod
+    @lru_cache(maxsize=8192)
+    def _extract_module_name(file_path: str) -> str:
+        """从文件路径提取模块名（按路径字符串缓存）"""
+        file_path = Path(file_path)
         # 尝试从路径推断模块名
         parts = list(file_path.parts)
         
@@ -157,91 +339,129 @@ class LuaDecoder:
             lua_index = parts.index('lua')
             module_parts = parts[lua_index + 1:]
             # 移除.lua.unluac或.lua扩展名
-            if module_parts and module_parts[-1].endswith('.lua.unluac'):
-                module_parts[-1] = module_parts[-1][:-10]  # 移除 .lua.unluac
-            elif module_parts and module_parts[-1].endswith('.lua'):
-                module_parts[-1] = module_parts[-1][:-4]   # 移除 .lua
+            if module_parts:
+                module_parts[-1] = module_parts[-1].removesuffix('.lua.unluac').removesuffix('.lua')
             return '.'.join(module_parts)
         except ValueError:
             # 如果没有找到lua目录，使用文件名
-            filename = file_path.stem
             # 如果文件名以.lua结尾，移除它
-            if filename.endswith('.lua'):
-                filename = filename[:-4]
-            return filename
+            return file_path.stem.removesuffix('.lua')
     
     def discover_dependencies_recursively(self, start_file: Path, max_depth: int = 10):
+        """
+        递归发现所有依赖（adiscover_dependencies_recursively 的同步封装）
+        
+        Args:
+            start_file: 起始文件
+            max_depth: 最大递归深度
+        """
+        self._run_sync(self.adiscover_dependencies_recursively(start_file, max_depth))
+    
+    async def adiscover_dependencies_recursively(self, start_file: Path, max_depth: int = 10):
         """
         递归发现所有依赖
         
+        按深度逐层推进，同一层的文件互不依赖，交给LLM并发分析
+        
         Args:
             start_file: 起始文件
             max_depth: 最大递归深度
         """
         self.logger.info(f"开始递归发现依赖，起始文件: {start_file}")
         
-        files_to_process = [(start_file, 0)]  # (文件路径, 深度)
+        current_level = [start_file]
         processed = set()
+        depth = 0
         
         with tqdm(desc="发现依赖", unit="文件") as pbar:
-            while files_to_process:
-                current_file, depth = files_to_process.pop(0)
-                current_file_str = str(current_file)
-                
-                if current_file_str in processed or depth > max_depth:
-                    continue
+            while current_level and depth <= max_depth:
+                # 去重，同一文件只分析一次（按解析符号链接和..后的真实路径判断）
+                batch = []
+                for current_file in current_level:
+                    current_file_str = os.path.realpath(current_file)
+                    if current_file_str not in processed:
+                        processed.add(current_file_str)
+                        batch.append(current_file)
                 
-                processed.add(current_file_str)
-                pbar.set_description(f"分析文件: {current_file.name}")
+                pbar.set_description(f"分析第 {depth} 层依赖（{len(batch)} 个文件）")
                 
-                                # 分析当前文件
-                analysis_result = self.analyze_file_dependencies(current_file)
+                # 并发分析当前层的所有文件
+                analysis_results = await self.aanalyze_files(batch)
                 
-                # 初始化requires变量
-                requires = []
-                if 'error' not in analysis_result:
-                    # 获取依赖的模块
-                    requires = analysis_result.get('requires', [])
+                # 预先并行解析本层出现的所有依赖模块
+                self.resolver.warm_cache(
+                    (req_module
+                     for analysis_result in analysis_results if 'error' not in analysis_result
+                     for req_module in analysis_result.get('requires', [])),
+                    workers=self.max_workers
+                )
                 
-                # 查找依赖文件并添加到处理队列
-                for req_module in requires:
-                    if depth < max_depth:
-                        # 首先尝试标准路径解析
-                        dep_file = self.resolver.resolve_module_to_path(req_module)
-                        if dep_file and dep_file.exists() and str(dep_file) not in processed:
-                            files_to_process.append((dep_file, depth + 1))
-                            continue
-                        
-                        # 在unluac目录中查找依赖文件，优先查找 .lua.unluac 文件
-                        for search_path in self.resolver.base_paths:
-                            search_path_obj = Path(search_path)
-                            if search_path_obj.exists():
-                                # 将模块名转换为可能的文件路径，优先查找 .lua.unluac 文件
-                                module_parts = req_module.split('.')
-                                possible_paths = [
-                                    search_path_obj / '/'.join(module_parts) / f"{module_parts[-1]}.lua.unluac",
-                                    search_path_obj / '/'.join(module_parts) / f"{module_parts[-1]}.lua",
-                                    search_path_obj / f"{module_parts[-1]}.lua.unluac",
-                                    search_path_obj / f"{module_parts[-1]}.lua"
-                                ]
-                                
-                                for possible_path in possible_paths:
-                                    if possible_path.exists() and str(possible_path) not in processed:
-                                        # 只处理 .lua.unluac 文件
-                                        if possible_path.name.endswith('.lua.unluac'):
-                                            self.logger.info(f"在搜索路径中找到依赖文件: {req_module} -> {possible_path}")
-                                            files_to_process.append((possible_path, depth + 1))
-                                            break
-                                        elif possible_path.name.endswith('.lua') and not possible_path.name.endswith('.lua.unluac'):
-                                            # 跳过普通的 .lua 文件，只处理 .lua.unluac
-                                            continue
-                                break
+                # 查找依赖文件，组成下一层
+                next_level = []
+                for analysis_result in analysis_results:
+                    if 'error' in analysis_result or depth >= max_depth:
+                        continue
+                    
+                    for req_module in analysis_result.get('requires', []):
+                        dep_file = self._find_dependency_file(req_module, processed)
+                        if dep_file is not None:
+                            next_level.append(dep_file)
                 
-                pbar.update(1)
+                pbar.update(len(batch))
+                current_level = next_level
+                depth += 1
         
         self.logger.info(f"依赖发现完成，共处理 {len(processed)} 个文件")
     
+    def _find_dependency_file(self, req_module: str, processed: Set[str]) -> Optional[Path]:
+        """
+        查找依赖模块对应的待分析文件
+        
+        Args:
+            req_module: 被依赖的模块名
+            processed: 已处理文件的真实路径集合
+            
+        Returns:
+            找到的文件路径，找不到或已处理则返回None
+        """
+        # 首先尝试标准路径解析
+        dep_file = self.resolver.resolve_module_to_path(req_module)
+        if dep_file and dep_file.exists() and os.path.realpath(dep_file) not in processed:
+            return dep_file
+        
+        # 在unluac目录中查找依赖文件，优先查找 .lua.unluac 文件
+        for search_path in self.resolver.base_paths:
+            search_path_obj = Path(search_path)
+            if search_path_obj.exists():
+                # 将模块名转换为可能的文件路径，优先查找 .lua.unluac 文件
+                module_parts = req_module.split('.')
+                possible_paths = [
+                    search_path_obj / '/'.join(module_parts) / f"{module_parts[-1]}.lua.unluac",
+                    search_path_obj / '/'.join(module_parts) / f"{module_parts[-1]}.lua",
+                    search_path_obj / f"{module_parts[-1]}.lua.unluac",
+                    search_path_obj / f"{module_parts[-1]}.lua"
+                ]
+                
+                for possible_path in possible_paths:
+                    if possible_path.exists() and os.path.realpath(possible_path) not in processed:
+                        # 只处理 .lua.unluac 文件，跳过普通的 .lua 文件
+                        if possible_path.name.endswith('.lua.unluac'):
+                            self.logger.debug(f"在搜索路径中找到依赖文件: {req_module} -> {possible_path}")
+                            return possible_path
+                break
+        
+        return None
+    
     def restore_code_in_order(self, output_dir: str = "output"):
+        """
+        按依赖顺序恢复代码（arestore_code_in_order 的同步封装）
+        
+        Args:
+            output_dir: 输出目录
+        """
+        self._run_sync(self.arestore_code_in_order(output_dir))
+    
+    async def arestore_code_in_order(self, output_dir: str = "output"):
         """
         按依赖顺序恢复代码
         
@@ -251,7 +471,7 @@ class LuaDecoder:
         self.logger.info("开始按依赖顺序恢复代码")
         
         # 获取恢复顺序
-        if not self.dependency_graph.graph:
+        if not self.dependency_graph:
             self.logger.warning("依赖图为空，无法进行代码恢复")
             return
         
@@ -260,24 +480,39 @@ class LuaDecoder:
         if cycles:
             self.logger.warning(f"检测到循环依赖: {cycles}")
         
-        # 获取拓扑排序结果
-        restoration_order = self.dependency_graph.topological_sort()
+        # 获取分层的拓扑排序结果，同层文件互不依赖
+        restoration_levels = self.dependency_graph.topological_levels()
+        
+        # 处在循环依赖上的文件不会出现在任何一层，放到最后一层恢复
+        leveled = {file_path for level in restoration_levels for file_path in level}
+        cyclic_files = [file_path for file_path in self.dependency_graph.get_all_files()
+                        if file_path not in leveled]
+        if cyclic_files:
+            self.logger.warning(f"{len(cyclic_files)} 个文件处在循环依赖中，将在最后一层恢复")
+            restoration_levels.append(cyclic_files)
         
         # 创建输出目录
         output_path = Path(output_dir)
         output_path.mkdir(exist_ok=True)
         
-        # 按顺序恢复代码
-        with tqdm(restoration_order, desc="恢复代码", unit="文件") as pbar:
-            for file_path in pbar:
-                pbar.set_description(f"恢复: {Path(file_path).name}")
-                
-                try:
-                    self._restore_single_file(file_path, output_path)
-                    self.restored_files.add(file_path)
-                except Exception as e:
-                    self.logger.error(f"恢复文件 {file_path} 失败: {e}")
-                    self.failed_files.add(file_path)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        total_files = sum(len(level) for level in restoration_levels)
+        
+        # 逐层恢复代码，层内并发
+        with tqdm(total=total_files, desc="恢复代码", unit="文件") as pbar:
+            async def restore_one(file_path: str):
+                async with semaphore:
+                    try:
+                        await self._arestore_single_file(file_path, output_path)
+                        self.restored_files.add(file_path)
+                    except Exception as e:
+                        self.logger.error(f"恢复文件 {file_path} 失败: {e}")
+                        self.failed_files.add(file_path)
+                pbar.update(1)
+            
+            for depth, level in enumerate(restoration_levels):
+                pbar.set_description(f"恢复第 {depth} 层")
+                await asyncio.gather(*(restore_one(file_path) for file_path in level))
         
         self.logger.info(f"代码恢复完成，成功恢复 {len(self.restored_files)} 个文件")
         
@@ -289,31 +524,27 @@ class LuaDecoder:
         # 生成报告
         self._generate_report(output_path)
     
-    def _restore_single_file(self, file_path: str, output_dir: Path):
+    async def _arestore_single_file(self, file_path: str, output_dir: Path):
         """恢复单个文件，保持原有目录结构"""
         file_path_obj = Path(file_path)
         
-        # 获取文件内容
-        content = self.dependency_graph.file_contents.get(file_path, "")
-        if not content:
-            # 如果缓存中没有，重新读取
-            try:
-                with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                    content = f.read()
-            except Exception as e:
-                self.logger.error(f"读取文件 {file_path} 失败: {e}")
-                return
-        
-        # 获取依赖信息
-        dependencies = list(self.dependency_graph.get_dependencies(Path(file_path)))
+        # 获取文件内容，优先使用依赖图中的缓存，未缓存时在线程中读盘避免阻塞事件循环
+        content, error = await asyncio.to_thread(self.dependency_graph.read_file, file_path_obj)
+        if error is not None:
+            self.logger.error(f"读取文件 {file_path} 失败: {error}")
+            return
+        
+        # 获取依赖信息，排序后写入提示词，保证每次运行的缓存键一致
+        dependencies = self.dependency_graph.get_dependencies(Path(file_path))
         dep_modules = []
         for dep in dependencies:
             module_name = self.dependency_graph.file_to_module.get(dep, "")
             if module_name:
                 dep_modules.append(module_name)
+        dep_modules.sort()
         
         # 使用LLM恢复代码
-        restored_code = self.llm_client.restore_lua_code(
+        restored_code = await self.llm_client.arestore_lua_code(
             file_path_obj, content, dep_modules
         )
         
@@ -331,30 +562,36 @@ class LuaDecoder:
         
         # 处理 .lua.unluac 文件，替换为 .lua
         if relative_path.suffixes == ['.lua', '.unluac']:
-            # 移除 .lua.unluac 扩展名，只保留 .lua
-            # 构建新的文件名：移除最后两个扩展名，然后添加 .lua
-            new_name = relative_path.stem  # 移除 .lua.unluac
-            if new_name.endswith('.lua'):
-                new_name = new_name[:-4]  # 再移除 .lua
+            # 移除 .lua.unluac 扩展名，然后添加 .lua
+            new_name = relative_path.name.removesuffix('.unluac').removesuffix('.lua')
             output_file = output_dir / relative_path.parent / f"{new_name}.lua"
         else:
             output_file = output_dir / relative_path
         
-        # 确保输出目录存在
-        output_file.parent.mkdir(parents=True, exist_ok=True)
+        # 在线程中写盘，同层其他文件的LLM请求可以继续进行
+        await asyncio.to_thread(self._write_output, output_file, restored_code)
         
-        # 保存恢复后的代码
-        with open(output_file, 'w', encoding='utf-8') as f:
-            f.write(restored_code)
-        
-        self.logger.info(f"文件 {file_path} 恢复完成，保存到 {output_file}")
+        self.logger.debug(f"文件 {file_path} 恢复完成，保存到 {output_file}")
         self.restored_files.add(file_path)
     
+    @staticmethod
+    def _write_output(output_file: Path, code: str):
+        """
+        保存恢复后的代码，必要时创建输出目录
+        
+        Args:
+            output_file: 输出文件路径
+            code: 恢复后的代码
+        """
+        output_file.parent.mkdir(parents=True, exist_ok=True)
+        with open(output_file, 'w', encoding='utf-8') as f:
+            f.write(code)
+    
     def _generate_report(self, output_dir: Path):
         """生成恢复报告"""
         report_file = output_dir / "restoration_report.txt"
         
-        with open(report_file, 'w', encoding='utf-8') as f:
+        with open(report_file, 'w', encoding='utf-8', buffering=1 << 20) as f:
             f.write("Lua代码恢复报告\n")
             f.write("=" * 50 + "\n\n")
             
@@ -364,14 +601,12 @@ class LuaDecoder:
             
             if self.restored_files:
                 f.write("成功恢复的文件:\n")
-                for file_path in sorted(self.restored_files):
-                    f.write(f"  - {file_path}\n")
+                f.writelines(f"  - {file_path}\n" for file_path in sorted(self.restored_files))
                 f.write("\n")
             
             if self.failed_files:
                 f.write("恢复失败的文件:\n")
-                for file_path in sorted(self.failed_files):
-                    f.write(f"  - {file_path}\n")
+                f.writelines(f"  - {file_path}\n" for file_path in sorted(self.failed_files))
                 f.write("\n")
             
             # 依赖图统计
@@ -391,6 +626,34 @@ class LuaDecoder:
             unluac_dir: unluac文件所在目录
             output_dir: 输出目录
         """
+        asyncio.run(self.arun(start_file, unluac_dir, output_dir))
+    
+    def _run_sync(self, coro):
+        """在新的事件循环中运行协程，结束后关闭绑定到该循环的异步客户端"""
+        async def runner():
+            try:
+                return await coro
+            finally:
+                await self.llm_client.aclose()
+        
+        return asyncio.run(runner())
+    
+    async def arun(self, start_file: str, unluac_dir: str, output_dir: str = "output"):
+        """
+        run 的异步版本
+        
+        Args:
+            start_file: 起始文件路径
+            unluac_dir: unluac文件所在目录
+            output_dir: 输出目录
+        """
+        try:
+            await self._arun(start_file, unluac_dir, output_dir)
+        finally:
+            await self.llm_client.aclose()
+    
+    async def _arun(self, start_file: str, unluac_dir: str, output_dir: str):
+        """解码流程主体"""
         self.logger.info("开始运行Lua解码器")
         
         # 添加unluac目录到搜索路径
@@ -413,13 +676,16 @@ class LuaDecoder:
         
         print(f"{Fore.GREEN}开始分析起始文件: {start_file}{Style.RESET_ALL}")
         
-        # 递归发现依赖
-        self.discover_dependencies_recursively(start_file_path)
+        # 递归发现依赖，内容未变化的文件复用上次的分析结果
+        manifest_file = Path(output_dir) / ".cache" / "manifest.json"
+        self._load_manifest(manifest_file)
+        await self.adiscover_dependencies_recursively(start_file_path)
+        self._save_manifest(manifest_file)
         
         print(f"{Fore.GREEN}依赖发现完成，开始代码恢复...{Style.RESET_ALL}")
         
         # 恢复代码
-        self.restore_code_in_order(output_dir)
+        await self.arestore_code_in_order(output_dir)
         
         print(f"{Fore.GREEN}Lua解码完成！{Style.RESET_ALL}")
         print(f"输出目录: {output_dir}")
@@ -427,7 +693,7 @@ class LuaDecoder:
         print(f"失败文件: {len(self.failed_files)} 个")
         
         # 显示依赖图
-        if self.dependency_graph.graph:
+        if self.dependency_graph:
             print(f"\n{Fore.CYAN}依赖关系图:{Style.RESET_ALL}")
             self.dependency_graph.print_graph()
 
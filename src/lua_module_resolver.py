@@ -6,12 +6,28 @@ Lua模块路径解析器
 """
 
 import os
+import re
 import sys
+import threading
 from pathlib import Path
-from typing import List, Optional, Tuple
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from concurrent.futures import ThreadPoolExecutor
 import platform
 
 
+# 匹配 require("module.name")、require 'module.name'，以及unluac输出的寄存器写法
+#   L0_0 = require
+#   L1_1 = "module.name"
+# 每种写法各占一个分组
+_REQUIRE_RE = re.compile(
+    r'''require\s*(?:\(\s*["']([^"']+)["']\s*\)'''
+    r'''|["']([^"']+)["']'''
+    r'''|\n\s*\w+\s*=\s*["']([^"']+)["'])'''
+)
+# 所有出现的require标识符，用于判断是否有未能静态解析的调用
+_REQUIRE_WORD_RE = re.compile(r'\brequire\b')
+
+
 class LuaModuleResolver:
     """Lua模块路径解析器"""
     
@@ -46,6 +62,14 @@ class LuaModuleResolver:
                 ]
         else:
             self.base_paths = base_paths
+        
+        # 模块名到解析结果的缓存（包括未找到的None），搜索路径变化时清空
+        self._resolve_cache: Dict[str, Optional[Path]] = {}
+        # find_module_file 的结果缓存，键为 (模块名, 搜索路径元组)
+        self._find_cache: Dict[Tuple[str, Tuple[str, ...]], Optional[Path]] = {}
+        # 搜索路径 -> (相对路径集合, 文件名到首个同名文件相对路径的映射)，首次查找时扫描建立
+        self._index: Dict[str, Tuple[Set[str], Dict[str, str]]] = {}
+        self._index_lock = threading.Lock()
     
     def resolve_module_to_path(self, module_name: str) -> Optional[Path]:
         """
@@ -57,29 +81,46 @@ class LuaModuleResolver:
         Returns:
             对应的文件路径，如果找不到则返回None
         """
-        # 将模块名转换为路径
-        path_parts = module_name.split('.')
+        if module_name in self._resolve_cache:
+            return self._resolve_cache[module_name]
+        
+        file_path = self._resolve_uncached(module_name)
+        self._resolve_cache[module_name] = file_path
+        return file_path
+    
+    def _resolve_uncached(self, module_name: str) -> Optional[Path]:
+        """在搜索路径中逐个尝试解析模块，不经过缓存"""
+        # 将模块名转换为相对路径
+        module_path = os.path.join(*module_name.split('.'))
         
         # 尝试不同的文件扩展名，优先处理 .lua.unluac 文件
         extensions = ['.lua.unluac', '.lua', '.so', '.dll', '.dylib']
         
         for base_path in self.base_paths:
-            base_path_obj = Path(base_path)
+            rel_paths, _ = self._get_index(base_path)
             
-            # 构建完整路径
             for ext in extensions:
-                # 方法1: 直接拼接路径
-                file_path = base_path_obj / '/'.join(path_parts) / ext.lstrip('.')
-                if file_path.exists():
-                    return file_path
-                
-                # 方法2: 使用os.path.join (更兼容)
-                file_path = Path(os.path.join(base_path, *path_parts) + ext)
-                if file_path.exists():
-                    return file_path
+                if module_path + ext in rel_paths:
+                    return Path(os.path.join(base_path, module_path + ext))
         
         return None
     
+    def warm_cache(self, modules: Iterable[str], workers: int = 8):
+        """
+        预先并行解析一批模块并写入缓存
+        
+        Args:
+            modules: 模块名列表
+            workers: 解析线程数
+        """
+        pending = [m for m in set(modules) if m not in self._resolve_cache]
+        if not pending:
+            return
+        
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(self._resolve_uncached, pending))
+        self._resolve_cache.update(zip(pending, results))
+    
     def find_module_file(self, module_name: str, search_paths: List[str] = None) -> Optional[Path]:
         """
         在指定路径中查找模块文件
@@ -94,6 +135,16 @@ class LuaModuleResolver:
         if search_paths is None:
             search_paths = self.base_paths
         
+        key = (module_name, tuple(search_paths))
+        if key in self._find_cache:
+            return self._find_cache[key]
+        
+        file_path = self._find_uncached(module_name, search_paths)
+        self._find_cache[key] = file_path
+        return file_path
+    
+    def _find_uncached(self, module_name: str, search_paths: List[str]) -> Optional[Path]:
+        """在给定路径中逐个查找模块文件，不经过缓存"""
         # 将模块名转换为可能的文件名
         module_parts = module_name.split('.')
         
@@ -105,66 +156,120 @@ class LuaModuleResolver:
         ]
         
         for search_path in search_paths:
-            search_path_obj = Path(search_path)
+            rel_paths, first_by_name = self._get_index(search_path)
             
             for name in possible_names:
                 # 尝试不同的扩展名
                 for ext in ['.lua', '.so', '.dll', '.dylib']:
-                    file_path = search_path_obj / f"{name}{ext}"
-                    if file_path.exists():
-                        return file_path
-                    
-                    # 尝试在子目录中查找
-                    for root, dirs, files in os.walk(search_path):
-                        for file in files:
-                            if file == f"{name}{ext}":
-                                return Path(root) / file
+                    file_name = f"{name}{ext}"
+                    # 优先取搜索路径根目录下的文件，其次是子目录中遍历到的第一个同名文件
+                    if file_name in rel_paths:
+                        return Path(search_path) / file_name
+                    if file_name in first_by_name:
+                        return Path(search_path) / first_by_name[file_name]
         
         return None
     
-    def get_module_dependencies(self, file_path: Path) -> List[str]:
+    def _get_index(self, search_path: str) -> Tuple[Set[str], Dict[str, str]]:
+        """
+        获取搜索路径的文件索引，首次访问时遍历一次目录树建立
+        
+        Args:
+            search_path: 搜索路径
+            
+        Returns:
+            (相对路径集合, 文件名到首个同名文件相对路径的映射)
+        """
+        with self._index_lock:
+            index = self._index.get(search_path)
+            if index is None:
+                index = self._index[search_path] = self._scan_directory(search_path)
+            return index
+    
+    @staticmethod
+    def _scan_directory(search_path: str) -> Tuple[Set[str], Dict[str, str]]:
+        """
+        遍历目录树，收集所有文件的相对路径
+        
+        跟随指向目录的符号链接（解包的固件中很常见），
+        链接指回当前路径上某个祖先目录时不再进入，避免死循环
+        """
+        rel_paths = set()
+        first_by_name = {}
+        # 目录 -> 从搜索路径到该目录途经的真实路径
+        ancestors = {search_path: (os.path.realpath(search_path),)}
+        
+        for root, dirs, files in os.walk(search_path, followlinks=True):
+            chain = ancestors.pop(root)
+            kept = []
+            for d in dirs:
+                dir_path = os.path.join(root, d)
+                real_dir = os.path.realpath(dir_path)
+                if real_dir not in chain:
+                    ancestors[dir_path] = chain + (real_dir,)
+                    kept.append(d)
+            dirs[:] = kept
+            
+            rel_root = os.path.relpath(root, search_path)
+            for file in files:
+                rel_path = file if rel_root == os.curdir else os.path.join(rel_root, file)
+                rel_paths.add(rel_path)
+                first_by_name.setdefault(file, rel_path)
+        
+        return rel_paths, first_by_name
+    
+    def get_module_dependencies(self, file_path: Path, content: str = None) -> List[str]:
         """
         从Lua文件中提取require语句
         
         Args:
             file_path: Lua文件路径
+            content: 文件内容，已读取时传入可避免再次读盘
             
         Returns:
             require的模块名列表
         """
-        dependencies = []
+        if content is None:
+            try:
+                with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
+                    content = f.read()
+            except Exception as e:
+                print(f"读取文件 {file_path} 时出错: {e}")
+                return []
         
-        try:
-            with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                content = f.read()
-                
-            # 简单的正则匹配require语句
-            import re
-            
-            # 匹配 require("module.name") 或 require 'module.name'
-            require_patterns = [
-                r'require\s*\(\s*["\']([^"\']+)["\']\s*\)',
-                r'require\s+["\']([^"\']+)["\']',
-            ]
-            
-            for pattern in require_patterns:
-                matches = re.findall(pattern, content)
-                dependencies.extend(matches)
-                
-        except Exception as e:
-            print(f"读取文件 {file_path} 时出错: {e}")
+        return self.scan_requires(content)[0]
+    
+    @staticmethod
+    def scan_requires(content: str) -> Tuple[List[str], bool]:
+        """
+        用正则提取文件内容中的require模块名
         
-        return list(set(dependencies))  # 去重
+        Args:
+            content: 文件内容
+            
+        Returns:
+            (按首次出现顺序去重的模块名列表, 是否每个require都解析出了模块名)
+        """
+        # 每个匹配只有一个分组非空
+        matches = [''.join(groups) for groups in _REQUIRE_RE.findall(content)]
+        complete = len(matches) >= len(_REQUIRE_WORD_RE.findall(content))
+        return list(dict.fromkeys(matches)), complete
     
     def add_search_path(self, path: str):
         """添加搜索路径"""
         if path not in self.base_paths:
             self.base_paths.append(path)
+            self._resolve_cache.clear()
+            self._find_cache.clear()
+            self._index.clear()
     
     def remove_search_path(self, path: str):
         """移除搜索路径"""
         if path in self.base_paths:
             self.base_paths.remove(path)
+            self._resolve_cache.clear()
+            self._find_cache.clear()
+            self._index.clear()
     
     def get_search_paths(self) -> List[str]:
         """获取所有搜索路径"""
@@ -15,7 +15,7 @@ if errorlevel 1 (
 
 REM 检查依赖是否安装
 echo 检查依赖...
-python -c "import requests, openai, pathlib2, colorama, tqdm, yaml" >nul 2>&1
+python -c "import httpx, orjson, openai, pathlib2, colorama, tqdm, yaml" >nul 2>&1
 if errorlevel 1 (
     echo 安装依赖...
     pip install -r requirements.txt
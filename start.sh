@@ -14,7 +14,7 @@ fi
 
 # 检查依赖是否安装
 echo "检查依赖..."
-if ! python3 -c "import requests, openai, pathlib2, colorama, tqdm, yaml" 2>/dev/null; then
+if ! python3 -c "import httpx, orjson, openai, pathlib2, colorama, tqdm, yaml" 2>/dev/null; then
     echo "安装依赖..."
     pip3 install -r requirements.txt
 fi